@@ -0,0 +1,95 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional
+
+from . import coc_api
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
+
+
+class AsyncCocClient:
+    # Coroutine facade over coc_api. Calls run on a bounded executor so they keep
+    # sharing the pooled session, rate limiter, retry policy, single-flight layer
+    # and cache with the sync functions instead of opening a second HTTP stack.
+    # The client owns its memo: payloads expire with their cache freshness and
+    # begin_run() drops them all, e.g. once per refresh cycle of a long loop.
+    def __init__(
+        self,
+        token: str,
+        sleep_seconds: float = 0.25,
+        cache_dir: str = CACHE_DIR,
+        ttl_seconds: int = 3600,
+        max_workers: int = 8,
+    ):
+        self.token = token
+        self.sleep_seconds = sleep_seconds
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.memo = coc_api.RunMemo()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], cache_dir: str = CACHE_DIR) -> "AsyncCocClient":
+        coc_api.configure_from_config(config)
+        return cls(
+            coc_api.read_token(config.get("tokenEnvVar", "COC_API_TOKEN")),
+            float(config.get("sleepSeconds", 0.25)),
+            cache_dir,
+            int(config.get("cacheTtlSeconds", 3600)),
+            int(config.get("maxWorkers", 8)),
+        )
+
+    async def __aenter__(self) -> "AsyncCocClient":
+        self.begin_run()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def begin_run(self) -> None:
+        self.memo.reset()
+
+    async def _call(self, func, tag: str):
+        loop = asyncio.get_running_loop()
+        call = partial(
+            func,
+            tag,
+            self.token,
+            self.sleep_seconds,
+            self.cache_dir,
+            self.ttl_seconds,
+            memo=self.memo,
+        )
+        return await loop.run_in_executor(self._executor, call)
+
+    async def get_clan(self, clan_tag: str):
+        return await self._call(coc_api.get_clan, clan_tag)
+
+    async def get_members(self, clan_tag: str):
+        return await self._call(coc_api.get_members, clan_tag)
+
+    async def get_player(self, player_tag: str):
+        return await self._call(coc_api.get_player, player_tag)
+
+    async def get_warlog(self, clan_tag: str) -> Optional[Dict[str, Any]]:
+        return await self._call(coc_api.get_warlog, clan_tag)
+
+    async def get_current_war(self, clan_tag: str):
+        return await self._call(coc_api.get_current_war, clan_tag)
+
+    async def gather_players(self, player_tags: List[str]) -> List[Dict[str, Any]]:
+        # One bulk cache read, then only the misses fan out on this executor
+        # (get_players would nest its own pool inside an executor slot).
+        loop = asyncio.get_running_loop()
+        call = partial(
+            coc_api.cached_players, list(player_tags), self.cache_dir, self.ttl_seconds, self.memo
+        )
+        results, missing = await loop.run_in_executor(self._executor, call)
+        fetched = await asyncio.gather(*(self.get_player(tag) for tag in missing))
+        results.update(zip(missing, fetched))
+        return [results[tag] for tag in player_tags]
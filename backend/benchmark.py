@@ -0,0 +1,314 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from . import coc_api, metrics
+from .cache import BACKENDS
+from .mock_api import start_mock_server
+from .synthetic import SyntheticWorld
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "benchmarks")
+
+# Synthetic world per scale; "war" stops at 80% of attacks like a live war day.
+SCALES = {
+    "clan": dict(clans=1),
+    "war": dict(clans=1, war_progress=0.8),
+    "clans100": dict(clans=100),
+    "players10k": dict(clans=100),
+}
+MODES = ("cold", "warm")
+BUILDER_STAGES = (
+    "build_profile",
+    "update_snapshot",
+    "build_aggregates",
+    "build_war_payload",
+    "update_execution",
+    "build_execution_payload",
+)
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def _fetch_args(cache_dir: str):
+    return ("benchmark", 0.0, cache_dir, 24 * 3600)
+
+
+def _run_export(world_info, config, cache_dir, output_dir, timer):
+    # Same entry point as run_pipeline, so the production defaults
+    # (incremental snapshot and war execution state) are what gets timed.
+    from .export.pipeline import export_clan, source_tags
+
+    clan_tag = world_info["clanTags"][0]
+    fetch_args = _fetch_args(cache_dir)
+    with timer.stage("fetch"):
+        sources = {
+            "clanTag": clan_tag,
+            "clan": coc_api.get_clan(clan_tag, *fetch_args),
+            "members": coc_api.get_members(clan_tag, *fetch_args),
+            "warlog": None,
+            "war": coc_api.get_current_war(clan_tag, *fetch_args),
+            "warError": None,
+        }
+        tags = source_tags(sources)
+        player_jsons = dict(
+            zip(tags, coc_api.get_players(tags, *fetch_args, config["maxWorkers"]))
+        )
+    with timer.stage("export"):
+        export_clan(sources, player_jsons, config, output_dir)
+
+
+def _run_clans100(world_info, config, cache_dir, output_dir, timer):
+    from .export.pipeline import run_batch
+
+    with timer.stage("batch"):
+        run_batch({**config, "clanTags": world_info["clanTags"]}, output_dir, cache_dir)
+
+
+def _run_players10k(world_info, config, cache_dir, output_dir, timer):
+    from .export.export_clan_snapshot import build_aggregates, build_profile
+
+    fetch_args = _fetch_args(cache_dir)
+    with timer.stage("fetch"):
+        player_jsons = coc_api.get_players(
+            world_info["playerTags"], *fetch_args, config["maxWorkers"]
+        )
+    with timer.stage("derive"):
+        profiles = [build_profile(player_json) for player_json in player_jsons]
+    # One roster of every player stresses the derive matrices, not the fetch.
+    with timer.stage("aggregate"):
+        build_aggregates(profiles)
+
+
+RUNNERS = {
+    "clan": _run_export,
+    "war": _run_export,
+    "clans100": _run_clans100,
+    "players10k": _run_players10k,
+}
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return round(peak * scale / (1024 * 1024), 1)
+
+
+def _run_once(scale, world_info, config, cache_dir, output_dir):
+    # Runs in a fresh process so peak RSS belongs to this scenario alone.
+    # The mock accepts any bearer token; run_batch reads it from the env.
+    os.environ.setdefault(config["tokenEnvVar"], "benchmark")
+    coc_api.configure_from_config(config)
+    coc_api.reset_run_memo()
+    metrics.reset()
+    timer = StageTimer()
+    start = time.perf_counter()
+    RUNNERS[scale](world_info, config, cache_dir, output_dir, timer)
+    coc_api.wait_for_refreshes()
+    wall = time.perf_counter() - start
+    # Builder timings from the run's own metrics gate the regression check too.
+    # run_batch resets them in fetch_settings, so they cover its whole run.
+    stages = dict(timer.stages)
+    for name in BUILDER_STAGES:
+        totals = metrics.snapshot()["stages"].get(name)
+        if totals:
+            stages[name] = totals["seconds"]
+    return {
+        "wall": wall,
+        "stages": stages,
+        "peakRssMb": _peak_rss_mb(),
+    }
+
+
+def _isolated(context, scale, world_info, config, cache_dir, output_dir):
+    # Pool workers are daemonic and could not start run_batch's process pool.
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(
+            _run_once, scale, world_info, config, cache_dir, output_dir
+        ).result()
+
+
+def _world_info(world: SyntheticWorld):
+    clan_tags = world.clan_tags
+    player_tags = [
+        tag
+        for clan_tag in clan_tags
+        for tag in world.member_tags(clan_tag) + world.member_tags(world.opponent_tag(clan_tag))
+    ]
+    return {"clanTags": clan_tags, "playerTags": player_tags}
+
+
+def run_scale(scale, args, context):
+    world = SyntheticWorld(seed=args.seed, **SCALES[scale])
+    server = start_mock_server(world, latency_ms=args.latency_ms)
+    config = {
+        "apiBaseUrl": server.base_url,
+        "tokenEnvVar": "COC_BENCHMARK_TOKEN",
+        "sleepSeconds": 0,
+        "maxWorkers": args.workers,
+        "httpPoolSize": args.workers,
+        "cacheBackend": args.cache_backend,
+        "cacheCompression": args.cache_compression,
+        "maxRetries": 0,
+        "batchProcesses": args.processes,
+    }
+    world_info = _world_info(world)
+    workdir = tempfile.mkdtemp(prefix=f"coc-bench-{scale}-")
+    results = {}
+    try:
+        for mode in MODES:
+            runs = []
+            for _ in range(args.repeat):
+                cache_dir = os.path.join(workdir, "cache")
+                # Outputs hold the incremental snapshot/execution state, so a cold
+                # run starts without them as well as without the API cache.
+                output_dir = os.path.join(workdir, "out")
+                if mode == "cold":
+                    shutil.rmtree(cache_dir, ignore_errors=True)
+                    shutil.rmtree(output_dir, ignore_errors=True)
+                elif not os.path.isdir(cache_dir):
+                    # Warm runs start from the cache and state of one untimed run.
+                    _isolated(context, scale, world_info, config, cache_dir, output_dir)
+                server.reset_stats()
+                run = _isolated(context, scale, world_info, config, cache_dir, output_dir)
+                run["apiCalls"] = server.stats.get("requests", 0)
+                runs.append(run)
+            results[f"{scale}/{mode}"] = _summarize(runs)
+            print(_format_row(f"{scale}/{mode}", results[f"{scale}/{mode}"]))
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def _summarize(runs):
+    # Median of repeats; stages use the run whose wall time was the median.
+    ordered = sorted(runs, key=lambda run: run["wall"])
+    median_run = ordered[len(ordered) // 2]
+    return {
+        "wall": round(statistics.median(run["wall"] for run in runs), 4),
+        "stages": {name: round(value, 4) for name, value in median_run["stages"].items()},
+        "peakRssMb": max(run["peakRssMb"] for run in runs),
+        "apiCalls": median_run["apiCalls"],
+        "repeats": len(runs),
+    }
+
+
+def _format_row(name, result):
+    stages = ", ".join(f"{stage} {value:.3f}s" for stage, value in result["stages"].items())
+    return (
+        f"{name:<22} {result['wall']:>8.3f}s  rss {result['peakRssMb']:>7.1f} MB  "
+        f"api {result['apiCalls']:>6}  [{stages}]"
+    )
+
+
+def compare(current, baseline, threshold, min_delta):
+    # A regression needs both a relative and an absolute slowdown so that
+    # sub-millisecond noise on small scales does not fail the run.
+    regressions = []
+    for name, result in current["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        checks = [("wall", result["wall"], previous["wall"])]
+        for stage, value in result["stages"].items():
+            if stage in previous.get("stages", {}):
+                checks.append((f"stage {stage}", value, previous["stages"][stage]))
+        for label, value, before in checks:
+            if value - before > min_delta and value > before * (1 + threshold):
+                regressions.append(
+                    f"{name} {label}: {before:.3f}s -> {value:.3f}s "
+                    f"(+{(value / before - 1) * 100 if before else float('inf'):.0f}%)"
+                )
+        if result["apiCalls"] > previous.get("apiCalls", result["apiCalls"]):
+            regressions.append(
+                f"{name} apiCalls: {previous['apiCalls']} -> {result['apiCalls']}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the export pipeline on synthetic data")
+    parser.add_argument("--scales", default="clan,war", help=f"Comma list of {', '.join(SCALES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--cache-backend", default="file", choices=list(BACKENDS))
+    parser.add_argument("--cache-compression", default="gzip", choices=["none", "gzip"])
+    parser.add_argument("--output", default=os.path.join(BASELINE_DIR, "latest.json"))
+    parser.add_argument("--baseline", help="Previous results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="Ignored slowdown (s)")
+    args = parser.parse_args()
+
+    scales = [scale.strip() for scale in args.scales.split(",") if scale.strip()]
+    unknown = [scale for scale in scales if scale not in SCALES]
+    if unknown:
+        raise RuntimeError(f"Unknown scales: {', '.join(unknown)}")
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for scale in scales:
+        results.update(run_scale(scale, args, context))
+
+    current = {
+        "meta": {
+            "generatedAt": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": args.seed,
+            "workers": args.workers,
+            "latencyMs": args.latency_ms,
+            "cacheBackend": args.cache_backend,
+            "cacheCompression": args.cache_compression,
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as handle:
+        json.dump(current, handle, indent=2)
+    print(f"Resultados guardados en {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        regressions = compare(current, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print("Regresiones:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("Sin regresiones frente a la línea base.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,504 @@
+import argparse
+import gzip
 import json
 import os
+import re
+import sqlite3
+import tempfile
+import threading
 import time
+import zlib
 from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
 
+from . import metrics
 
-def _cache_path(cache_dir: str, key: str) -> str:
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+_META_FIELDS = ("etag", "lastModified", "maxAge")
+
+
+_SUFFIXES = {"none": ".json", "gzip": ".json.gz"}
+# Writers that crash leave their temp file behind; compact removes old ones.
+_TMP_GRACE_SECONDS = 3600
+# Last use only feeds LRU eviction, so reads refresh it at most this often per
+# entry instead of writing on every lookup.
+LAST_ACCESS_GRANULARITY = 300
+
+
+def _cache_path(cache_dir: str, key: str, suffix: str = ".json") -> str:
     safe_key = key.replace("#", "").replace("/", "_")
-    return os.path.join(cache_dir, f"{safe_key}.json")
+    return os.path.join(cache_dir, f"{safe_key}{suffix}")
 
 
-def cache_get(cache_dir: str, key: str, ttl_seconds: int):
-    path = _cache_path(cache_dir, key)
-    if not os.path.exists(path):
-        return None
-    with open(path, "r", encoding="utf-8") as handle:
-        payload = json.load(handle)
-    fetched_at = payload.get("fetchedAt")
-    if not fetched_at:
+def _read_json_file(path: str):
+    with open(path, "rb") as handle:
+        raw = handle.read()
+    metrics.inc("cache_bytes_read_total", len(raw), backend="file")
+    if path.endswith(".gz"):
+        raw = gzip.decompress(raw)
+    return json.loads(raw)
+
+
+class FileStore:
+    def __init__(self, cache_dir: str, compression: str = "none"):
+        if compression not in _SUFFIXES:
+            raise RuntimeError(f"Unknown cache compression {compression}")
+        self.cache_dir = cache_dir
+        self.compression = compression
+        # Current format first; the other one covers entries written before a
+        # config change (including legacy pretty-printed .json files).
+        self._read_suffixes = [_SUFFIXES[compression]] + [
+            suffix for suffix in _SUFFIXES.values() if suffix != _SUFFIXES[compression]
+        ]
+
+    def get(self, key: str) -> Optional[Dict]:
+        for suffix in self._read_suffixes:
+            path = _cache_path(self.cache_dir, key, suffix)
+            try:
+                payload = _read_json_file(path)
+            except FileNotFoundError:
+                continue
+            if not payload.get("fetchedAt"):
+                return None
+            # atime tracks last use for LRU eviction; mtime is the last write or
+            # 304 revalidation (touch), so it is when the entry was last known fresh.
+            try:
+                stat = os.stat(path)
+                now = time.time()
+                if now - stat.st_atime >= LAST_ACCESS_GRANULARITY:
+                    os.utime(path, (now, stat.st_mtime))
+            except OSError:
+                return payload
+            if stat.st_mtime > datetime.fromisoformat(payload["fetchedAt"]).timestamp():
+                payload["fetchedAt"] = datetime.fromtimestamp(
+                    stat.st_mtime, timezone.utc
+                ).isoformat()
+            return payload
         return None
-    fetched_ts = datetime.fromisoformat(fetched_at).timestamp()
-    if time.time() - fetched_ts > ttl_seconds:
+
+    def get_meta(self, key: str) -> Optional[Dict]:
+        return self.get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        entries = {}
+        for key in keys:
+            entry = self.get(key)
+            if entry is not None:
+                entries[key] = entry
+        return entries
+
+    def put(self, key: str, entry: Dict) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        suffix = _SUFFIXES[self.compression]
+        path = _cache_path(self.cache_dir, key, suffix)
+        body = json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if self.compression == "gzip":
+            body = gzip.compress(body, compresslevel=6, mtime=0)
+        metrics.inc("cache_bytes_written_total", len(body), backend="file")
+        # Write-then-rename so concurrent readers never see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(body)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        for other in self._read_suffixes[1:]:
+            try:
+                os.remove(_cache_path(self.cache_dir, key, other))
+            except FileNotFoundError:
+                pass
+
+    def touch(self, key: str, entry: Dict, meta: Dict) -> None:
+        # Unchanged validators and max-age only need a new mtime; the body is
+        # rewritten only when the 304 changed the stored metadata.
+        if all(entry.get(name) == meta.get(name) for name in _META_FIELDS):
+            now = time.time()
+            for suffix in self._read_suffixes:
+                try:
+                    os.utime(_cache_path(self.cache_dir, key, suffix), (now, now))
+                    return
+                except FileNotFoundError:
+                    continue
+        fetched_at = datetime.now(timezone.utc).isoformat()
+        self.put(key, {"fetchedAt": fetched_at, **meta, "data": entry.get("data")})
+
+    def _scan(self) -> List[Tuple[str, float, float, int]]:
+        if not os.path.isdir(self.cache_dir):
+            return []
+        files = []
+        for item in os.scandir(self.cache_dir):
+            if not item.is_file() or not item.name.endswith(tuple(_SUFFIXES.values())):
+                continue
+            stat = item.stat()
+            files.append((item.path, stat.st_mtime, stat.st_atime, stat.st_size))
+        return files
+
+    def prune(self, max_age_seconds=None, max_entries=None, max_bytes=None) -> Dict:
+        files = self._scan()
+        removed = []
+        if max_age_seconds is not None:
+            cutoff = time.time() - max_age_seconds
+            removed = [item for item in files if item[1] < cutoff]
+            files = [item for item in files if item[1] >= cutoff]
+        files.sort(key=lambda item: item[2], reverse=True)
+        keep, total_bytes = [], 0
+        for item in files:
+            over_entries = max_entries is not None and len(keep) >= max_entries
+            over_bytes = max_bytes is not None and total_bytes + item[3] > max_bytes
+            if over_entries or over_bytes:
+                removed.append(item)
+                continue
+            keep.append(item)
+            total_bytes += item[3]
+        for item in removed:
+            try:
+                os.remove(item[0])
+            except FileNotFoundError:
+                pass
+        return {"removed": len(removed), "entries": len(keep), "bytes": total_bytes}
+
+    def compact(self) -> None:
+        if not os.path.isdir(self.cache_dir):
+            return
+        cutoff = time.time() - _TMP_GRACE_SECONDS
+        for item in os.scandir(self.cache_dir):
+            if item.name.endswith(".tmp") and item.stat().st_mtime < cutoff:
+                try:
+                    os.remove(item.path)
+                except FileNotFoundError:
+                    pass
+
+
+class SqliteStore:
+    FILENAME = "cache.sqlite3"
+
+    # Bodies are always zlib-compressed in SQLite, so compression is ignored.
+    def __init__(self, cache_dir: str, compression: str = "none"):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, self.FILENAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, fetched_at REAL NOT NULL, etag TEXT, "
+                "last_modified TEXT, max_age INTEGER, body BLOB NOT NULL)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(entries)")}
+            if "last_access" not in columns:
+                self._conn.execute("ALTER TABLE entries ADD COLUMN last_access REAL")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_fetched_at ON entries (fetched_at)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)"
+            )
+
+    @staticmethod
+    def _row_to_entry(row, with_body: bool = True) -> Dict:
+        entry = {
+            "fetchedAt": datetime.fromtimestamp(row[1], timezone.utc).isoformat(),
+            "etag": row[2],
+            "lastModified": row[3],
+            "maxAge": row[4],
+        }
+        if with_body:
+            metrics.inc("cache_bytes_read_total", len(row[5]), backend="sqlite")
+            entry["data"] = json.loads(zlib.decompress(row[5]))
+        return entry
+
+    def _mark_used(self, rows) -> None:
+        now = time.time()
+        stale = [
+            (now, row[0])
+            for row in rows
+            if row[6] is None or now - row[6] >= LAST_ACCESS_GRANULARITY
+        ]
+        if not stale:
+            return
+        with self._conn:
+            self._conn.executemany("UPDATE entries SET last_access = ? WHERE key = ?", stale)
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, fetched_at, etag, last_modified, max_age, body, last_access "
+                "FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row:
+                self._mark_used([row])
+        return self._row_to_entry(row) if row else None
+
+    def get_meta(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, fetched_at, etag, last_modified, max_age "
+                "FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+        return self._row_to_entry(row, with_body=False) if row else None
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        keys = list(keys)
+        entries = {}
+        # Stay well below SQLite's bound-parameter limit.
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, fetched_at, etag, last_modified, max_age, body, last_access "
+                    f"FROM entries WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                self._mark_used(rows)
+            for row in rows:
+                entries[row[0]] = self._row_to_entry(row)
+        return entries
+
+    def put(self, key: str, entry: Dict) -> None:
+        fetched_ts = datetime.fromisoformat(entry["fetchedAt"]).timestamp()
+        body = zlib.compress(
+            json.dumps(entry.get("data"), ensure_ascii=False, separators=(",", ":")).encode(
+                "utf-8"
+            )
+        )
+        metrics.inc("cache_bytes_written_total", len(body), backend="sqlite")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, fetched_at, etag, last_modified, max_age, body, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    fetched_ts,
+                    entry.get("etag"),
+                    entry.get("lastModified"),
+                    entry.get("maxAge"),
+                    body,
+                    time.time(),
+                ),
+            )
+
+    def touch(self, key: str, entry: Dict, meta: Dict) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE entries SET fetched_at = ?, etag = ?, last_modified = ?, "
+                "max_age = ?, last_access = ? WHERE key = ?",
+                (now, meta.get("etag"), meta.get("lastModified"), meta.get("maxAge"), now, key),
+            )
+        # Pruned while the request was in flight: store it again in full.
+        if cursor.rowcount == 0:
+            self.put(
+                key,
+                {
+                    "fetchedAt": datetime.fromtimestamp(now, timezone.utc).isoformat(),
+                    **meta,
+                    "data": entry.get("data"),
+                },
+            )
+
+    def prune(self, max_age_seconds=None, max_entries=None, max_bytes=None) -> Dict:
+        removed = 0
+        with self._lock, self._conn:
+            if max_age_seconds is not None:
+                cursor = self._conn.execute(
+                    "DELETE FROM entries WHERE fetched_at < ?",
+                    (time.time() - max_age_seconds,),
+                )
+                removed += cursor.rowcount
+            rows = self._conn.execute(
+                "SELECT key, length(body) FROM entries "
+                "ORDER BY COALESCE(last_access, fetched_at) DESC"
+            ).fetchall()
+            evicted, kept, total_bytes = [], 0, 0
+            for key, size in rows:
+                over_entries = max_entries is not None and kept >= max_entries
+                over_bytes = max_bytes is not None and total_bytes + size > max_bytes
+                if over_entries or over_bytes:
+                    evicted.append((key,))
+                    continue
+                kept += 1
+                total_bytes += size
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", evicted)
+            removed += len(evicted)
+        return {"removed": removed, "entries": kept, "bytes": total_bytes}
+
+    def compact(self) -> None:
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("VACUUM")
+
+
+BACKENDS = {"file": FileStore, "sqlite": SqliteStore}
+
+_backend = "file"
+_compression = "none"
+_stores: Dict[tuple, object] = {}
+_stores_lock = threading.Lock()
+
+
+def configure_backend(name: str, compression: str = "none") -> None:
+    global _backend, _compression
+    if name not in BACKENDS:
+        raise RuntimeError(f"Unknown cache backend {name}")
+    if compression not in _SUFFIXES:
+        raise RuntimeError(f"Unknown cache compression {compression}")
+    _backend = name
+    _compression = compression
+
+
+def get_store(cache_dir: str):
+    store_key = (_backend, _compression, os.path.abspath(cache_dir))
+    with _stores_lock:
+        store = _stores.get(store_key)
+        if store is None:
+            store = BACKENDS[_backend](cache_dir, _compression)
+            _stores[store_key] = store
+    return store
+
+
+def response_meta(headers: Mapping[str, str]) -> Dict:
+    max_age = None
+    cache_control = headers.get("Cache-Control") or ""
+    match = _MAX_AGE_RE.search(cache_control)
+    if match:
+        max_age = int(match.group(1))
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        max_age = 0
+    return {
+        "etag": headers.get("ETag"),
+        "lastModified": headers.get("Last-Modified"),
+        "maxAge": max_age,
+    }
+
+
+@metrics.timed("cache_get")
+def cache_get_entry(cache_dir: str, key: str) -> Optional[Dict]:
+    return get_store(cache_dir).get(key)
+
+
+def cache_get_meta(cache_dir: str, key: str) -> Optional[Dict]:
+    return get_store(cache_dir).get_meta(key)
+
+
+@metrics.timed("cache_get_many")
+def cache_get_many(cache_dir: str, keys: Iterable[str]) -> Dict[str, Dict]:
+    return get_store(cache_dir).get_many(keys)
+
+
+def entry_age(entry: Dict) -> float:
+    fetched_ts = datetime.fromisoformat(entry["fetchedAt"]).timestamp()
+    return time.time() - fetched_ts
+
+
+def freshness_limit(max_age: Optional[int], ttl_seconds: float) -> float:
+    # Server freshness (Cache-Control max-age) wins over the configured TTL.
+    return max_age if max_age is not None else ttl_seconds
+
+
+def entry_staleness(entry: Dict, ttl_seconds: float) -> float:
+    return entry_age(entry) - freshness_limit(entry.get("maxAge"), ttl_seconds)
+
+
+def entry_is_fresh(entry: Dict, ttl_seconds: int) -> bool:
+    return entry_staleness(entry, ttl_seconds) <= 0
+
+
+def entry_validators(entry: Optional[Dict]) -> Dict[str, str]:
+    validators = {}
+    if not entry:
+        return validators
+    if entry.get("etag"):
+        validators["If-None-Match"] = entry["etag"]
+    if entry.get("lastModified"):
+        validators["If-Modified-Since"] = entry["lastModified"]
+    return validators
+
+
+@metrics.timed("cache_get")
+def cache_get(cache_dir: str, key: str, ttl_seconds: int):
+    store = get_store(cache_dir)
+    meta = store.get_meta(key)
+    if meta is None or not entry_is_fresh(meta, ttl_seconds):
         return None
-    return payload.get("data")
+    entry = meta if "data" in meta else store.get(key)
+    return entry.get("data") if entry else None
 
 
-def cache_set(cache_dir: str, key: str, data):
-    os.makedirs(cache_dir, exist_ok=True)
-    path = _cache_path(cache_dir, key)
-    payload = {
+@metrics.timed("cache_set")
+def cache_set(cache_dir: str, key: str, data, meta: Optional[Dict] = None):
+    entry = {
         "fetchedAt": datetime.now(timezone.utc).isoformat(),
+        **(meta or {}),
         "data": data,
     }
-    with open(path, "w", encoding="utf-8") as handle:
-        json.dump(payload, handle, ensure_ascii=False, indent=2)
+    get_store(cache_dir).put(key, entry)
+
+
+@metrics.timed("cache_touch")
+def cache_touch(cache_dir: str, key: str, entry: Dict, meta: Optional[Dict] = None):
+    # A 304 revalidation: keep the stored body, restart its freshness window and
+    # keep the old validators unless the server sent new ones. Only metadata is
+    # written; the body is not serialized again.
+    merged = {name: entry.get(name) for name in _META_FIELDS}
+    for name, value in (meta or {}).items():
+        if value is not None:
+            merged[name] = value
+    get_store(cache_dir).touch(key, entry, merged)
+
+
+def cache_prune(cache_dir: str, max_age_seconds=None, max_entries=None, max_bytes=None) -> Dict:
+    return get_store(cache_dir).prune(max_age_seconds, max_entries, max_bytes)
+
+
+def prune_from_config(cache_dir: str, config: Dict) -> Optional[Dict]:
+    limits = {
+        "max_age_seconds": config.get("cacheMaxAgeSeconds"),
+        "max_entries": config.get("cacheMaxEntries"),
+        "max_bytes": config.get("cacheMaxBytes"),
+    }
+    if all(value is None for value in limits.values()):
+        return None
+    return cache_prune(cache_dir, **limits)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the API cache")
+    parser.add_argument("command", choices=["compact"])
+    parser.add_argument(
+        "--config",
+        default=os.path.join(os.path.dirname(__file__), "config.example.json"),
+    )
+    parser.add_argument("--cache-dir", default=os.path.join(os.path.dirname(__file__), "cache"))
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as handle:
+        config = json.load(handle)
+    configure_backend(config.get("cacheBackend", "file"), config.get("cacheCompression", "none"))
+    # compact always drops entries past the max age, even without size budgets,
+    # but keeps anything still servable stale-while-revalidate.
+    config.setdefault(
+        "cacheMaxAgeSeconds",
+        int(config.get("cacheTtlSeconds", 3600))
+        + int(config.get("staleWhileRevalidateSeconds", 0)),
+    )
+    stats = prune_from_config(args.cache_dir, config)
+    get_store(args.cache_dir).compact()
+    # A config with every limit set to null prunes nothing.
+    if stats is None:
+        print("Cache compactado sin límites de poda.")
+        return
+    print(
+        f"Cache compactado: {stats['removed']} eliminadas, "
+        f"{stats['entries']} entradas, {stats['bytes']} bytes."
+    )
+
+
+if __name__ == "__main__":
+    main()
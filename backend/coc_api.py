@@ -1,31 +1,419 @@
 import os
+import random
+import threading
 import time
-from typing import Any, Dict, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from .cache import cache_get, cache_set
+from . import metrics
+from .cache import (
+    configure_backend,
+    cache_get_entry,
+    cache_get_many,
+    cache_set,
+    cache_touch,
+    entry_staleness,
+    entry_validators,
+    freshness_limit,
+    response_meta,
+)
 
-API_BASE = "https://api.clashofclans.com/v1"
+DEFAULT_API_BASE = "https://api.clashofclans.com/v1"
+# COC_API_BASE (or apiBaseUrl in the config) points the client at a stand-in
+# such as backend.mock_api.
+API_BASE = os.environ.get("COC_API_BASE") or DEFAULT_API_BASE
 
 
-def _request_json(url: str, token: str) -> Dict[str, Any]:
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/json",
-    }
-    response = requests.get(url, headers=headers, timeout=20)
-    if response.status_code >= 400:
-        raise RuntimeError(f"API error {response.status_code}: {response.text}")
-    return response.json()
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_limiter: Optional[TokenBucket] = None
+_limiter_lock = threading.Lock()
+
+
+def configure_rate_limit(requests_per_second: float, burst: float = 1.0) -> None:
+    global _limiter
+    with _limiter_lock:
+        _limiter = TokenBucket(requests_per_second, burst) if requests_per_second > 0 else None
+
+
+def _acquire(sleep_seconds: float) -> None:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None and sleep_seconds > 0:
+            # Legacy configs only carry sleepSeconds: treat it as the request spacing.
+            _limiter = TokenBucket(1 / sleep_seconds)
+        limiter = _limiter
+    if limiter is not None:
+        limiter.acquire()
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def configure_session(pool_size: int = 10, pool_connections: int = 1) -> requests.Session:
+    # pool_size caps connections per host; pool_block makes extra workers wait
+    # for a free keep-alive connection instead of opening throwaway ones.
+    global _session
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_size,
+        pool_block=True,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept": "application/json", "Connection": "keep-alive"})
+    with _session_lock:
+        previous, _session = _session, session
+    if previous is not None:
+        previous.close()
+    return session
+
+
+def _get_session() -> requests.Session:
+    with _session_lock:
+        session = _session
+    if session is None:
+        session = configure_session()
+    return session
 
 
-def _fetch_with_retry(url: str, token: str, sleep_seconds: float) -> Dict[str, Any]:
+def close_session() -> None:
+    global _session
+    with _session_lock:
+        session, _session = _session, None
+    if session is not None:
+        session.close()
+
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ApiError(RuntimeError):
+    def __init__(self, message: str, status: Optional[int] = None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        # status None means the request never got an HTTP answer (timeout, reset).
+        return self.status is None or self.status in RETRYABLE_STATUSES
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
     try:
-        return _request_json(url, token)
-    except RuntimeError:
-        time.sleep(max(0.5, sleep_seconds))
-        return _request_json(url, token)
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class RetryBudget:
+    # Each successful request earns `ratio` retries (up to `capacity`), so a
+    # brownout cannot multiply traffic by more than roughly 1 + ratio.
+    def __init__(self, ratio: float = 0.2, capacity: float = 20.0):
+        self.ratio = ratio
+        self.capacity = capacity
+        self._balance = capacity
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._balance = min(self.capacity, self._balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = 5, cooldown_seconds: float = 30.0):
+        self.threshold = threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_request(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.cooldown_seconds or self._probing:
+                raise ApiError("API circuit open: too many consecutive failures")
+            # Half-open: let a single probe through.
+            self._probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+_retry_policy = {"maxRetries": 3, "baseSeconds": 0.5, "maxSeconds": 30.0}
+_retry_budget = RetryBudget()
+_breaker = CircuitBreaker()
+
+
+def configure_retries(
+    max_retries: int = 3,
+    base_seconds: float = 0.5,
+    max_seconds: float = 30.0,
+    budget_ratio: float = 0.2,
+    breaker_threshold: int = 5,
+    breaker_cooldown_seconds: float = 30.0,
+) -> None:
+    global _retry_budget, _breaker
+    _retry_policy.update(
+        {"maxRetries": max_retries, "baseSeconds": base_seconds, "maxSeconds": max_seconds}
+    )
+    _retry_budget = RetryBudget(budget_ratio)
+    _breaker = CircuitBreaker(breaker_threshold, breaker_cooldown_seconds)
+
+
+def _backoff_delay(attempt: int, retry_after: Optional[float]) -> float:
+    ceiling = min(_retry_policy["maxSeconds"], _retry_policy["baseSeconds"] * 2**attempt)
+    delay = random.uniform(0, ceiling)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, _retry_policy["maxSeconds"]))
+    return delay
+
+
+def _endpoint_label(url: str) -> str:
+    # players, clans, members, currentwar, warlog: one series per endpoint.
+    parts = url[len(API_BASE) :].split("?")[0].strip("/").split("/")
+    if parts[0] != "clans" or len(parts) < 3:
+        return parts[0]
+    return parts[2]
+
+
+def _request(url: str, token: str, validators: Optional[Dict[str, str]] = None):
+    headers = {"Authorization": f"Bearer {token}", **(validators or {})}
+    endpoint = _endpoint_label(url)
+    start = time.perf_counter()
+    try:
+        response = _get_session().get(url, headers=headers, timeout=20)
+    except requests.RequestException as error:
+        metrics.observe("api_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+        metrics.inc("api_requests_total", endpoint=endpoint, status="error")
+        raise ApiError(f"API request failed: {error}") from error
+    metrics.observe("api_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+    metrics.inc("api_requests_total", endpoint=endpoint, status=response.status_code)
+    metrics.inc("api_bytes_read_total", len(response.content), endpoint=endpoint)
+    if response.status_code >= 400:
+        raise ApiError(
+            f"API error {response.status_code}: {response.text}",
+            response.status_code,
+            _parse_retry_after(response.headers.get("Retry-After")),
+        )
+    return response
+
+
+def _fetch_with_retry(
+    url: str,
+    token: str,
+    sleep_seconds: float,
+    validators: Optional[Dict[str, str]] = None,
+):
+    attempt = 0
+    while True:
+        _breaker.before_request()
+        _acquire(sleep_seconds)
+        try:
+            response = _request(url, token, validators)
+        except ApiError as error:
+            if not error.retryable:
+                # A 403/404 is a healthy API giving a permanent answer.
+                _breaker.record_success()
+                raise
+            _breaker.record_failure()
+            if attempt >= _retry_policy["maxRetries"]:
+                raise
+            if not _retry_budget.withdraw():
+                metrics.inc("api_retry_budget_exhausted_total")
+                raise
+            metrics.inc("api_retries_total", status=error.status or "error")
+            time.sleep(_backoff_delay(attempt, error.retry_after))
+            attempt += 1
+            continue
+        _breaker.record_success()
+        _retry_budget.deposit()
+        return response
+
+
+_max_stale_seconds = 0.0
+_refresh_executor: Optional[ThreadPoolExecutor] = None
+_refreshing: Dict[str, Future] = {}
+_refresh_lock = threading.Lock()
+
+
+def configure_stale_while_revalidate(max_stale_seconds: float) -> None:
+    global _max_stale_seconds
+    _max_stale_seconds = max(0.0, max_stale_seconds)
+
+
+def _revalidate(key: str, url: str, entry, token: str, sleep_seconds: float, cache_dir: str):
+    # Returns the payload and the max-age it is now stored with.
+    response = _fetch_with_retry(url, token, sleep_seconds, entry_validators(entry))
+    meta = response_meta(response.headers)
+    if response.status_code == 304 and entry is not None:
+        metrics.inc("cache_revalidations_total", result="not_modified")
+        cache_touch(cache_dir, key, entry, meta)
+        max_age = meta["maxAge"] if meta["maxAge"] is not None else entry.get("maxAge")
+        return entry.get("data"), max_age
+    if entry is not None:
+        metrics.inc("cache_revalidations_total", result="modified")
+    data = response.json()
+    cache_set(cache_dir, key, data, meta)
+    return data, meta["maxAge"]
+
+
+def _schedule_refresh(key: str, url: str, entry, token: str, sleep_seconds: float, cache_dir: str):
+    global _refresh_executor
+    with _refresh_lock:
+        if key in _refreshing:
+            return
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(max_workers=2)
+        future = _refresh_executor.submit(
+            _revalidate, key, url, entry, token, sleep_seconds, cache_dir
+        )
+        _refreshing[key] = future
+    future.add_done_callback(lambda _: _forget_refresh(key))
+
+
+def _forget_refresh(key: str) -> None:
+    with _refresh_lock:
+        _refreshing.pop(key, None)
+
+
+def wait_for_refreshes() -> None:
+    # Background refresh failures are not fatal: the stale entry stays in place
+    # and the next run retries it.
+    with _refresh_lock:
+        pending = list(_refreshing.values())
+    for future in pending:
+        try:
+            future.result()
+        except RuntimeError:
+            pass
+
+
+_MISSING = object()
+
+
+class RunMemo:
+    # Resolved payloads for one run, so repeated lookups skip the disk cache.
+    # Each payload is dropped once its cache entry would stop being fresh, so a
+    # long-lived memo never serves data the cache itself would refetch.
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, memo_key: Tuple[str, str]):
+        with self._lock:
+            item = self._entries.get(memo_key)
+            if item is None:
+                return _MISSING
+            if time.time() >= item[1]:
+                del self._entries[memo_key]
+                return _MISSING
+            return item[0]
+
+    def put(self, memo_key: Tuple[str, str], data, fresh_seconds: float) -> None:
+        if fresh_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[memo_key] = (data, time.time() + fresh_seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Default memo for callers that pass none (pipeline, watch loop, exporters);
+# in-flight fetches are shared by every memo: concurrent callers for one key
+# share a single cache read / network call.
+_run_memo = RunMemo()
+_inflight: Dict[Tuple[str, str], Future] = {}
+_flight_lock = threading.Lock()
+
+
+def reset_run_memo() -> None:
+    _run_memo.reset()
+
+
+def _load(
+    key: str,
+    url: str,
+    token: str,
+    sleep_seconds: float,
+    cache_dir: str,
+    ttl_seconds: int,
+    revalidate: bool = False,
+):
+    # Returns the payload and how many more seconds it counts as fresh.
+    entry = cache_get_entry(cache_dir, key)
+    if entry is not None and not revalidate:
+        staleness = entry_staleness(entry, ttl_seconds)
+        if staleness <= 0:
+            metrics.inc("cache_lookups_total", result="hit")
+            return entry.get("data"), -staleness
+        if staleness <= _max_stale_seconds:
+            metrics.inc("cache_lookups_total", result="stale")
+            _schedule_refresh(key, url, entry, token, sleep_seconds, cache_dir)
+            return entry.get("data"), 0
+    if entry is None:
+        metrics.inc("cache_lookups_total", result="miss")
+    else:
+        metrics.inc("cache_lookups_total", result="revalidate" if revalidate else "expired")
+    data, max_age = _revalidate(key, url, entry, token, sleep_seconds, cache_dir)
+    return data, freshness_limit(max_age, ttl_seconds)
 
 
 def _get_cached(
@@ -35,15 +423,45 @@ def _get_cached(
     sleep_seconds: float,
     cache_dir: str,
     ttl_seconds: int,
+    memo: Optional[RunMemo] = None,
+    revalidate: bool = False,
 ):
+    # revalidate sends a conditional request even while the entry is fresh.
+    memo = _run_memo if memo is None else memo
     key = f"{endpoint}_{tag}"
-    cached = cache_get(cache_dir, key, ttl_seconds)
-    if cached is not None:
-        return cached
+    memo_key = (cache_dir, key)
+    with _flight_lock:
+        data = _MISSING if revalidate else memo.get(memo_key)
+        if data is not _MISSING:
+            metrics.inc("memo_lookups_total", result="hit")
+            return data
+        future = _inflight.get(memo_key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[memo_key] = future
+    if not leader:
+        metrics.inc("memo_lookups_total", result="coalesced")
+        return future.result()
+
     url = f"{API_BASE}/{endpoint}/{tag.replace('#', '%23')}"
-    data = _fetch_with_retry(url, token, sleep_seconds)
-    cache_set(cache_dir, key, data)
-    time.sleep(sleep_seconds)
+    # Cache read plus any network round trips, per resolved (not memoized) key.
+    start = time.perf_counter()
+    try:
+        data, fresh_seconds = _load(
+            key, url, token, sleep_seconds, cache_dir, ttl_seconds, revalidate
+        )
+    except BaseException as error:
+        metrics.observe("fetch_seconds", time.perf_counter() - start, endpoint=_endpoint_label(url))
+        with _flight_lock:
+            _inflight.pop(memo_key, None)
+        future.set_exception(error)
+        raise
+    metrics.observe("fetch_seconds", time.perf_counter() - start, endpoint=_endpoint_label(url))
+    memo.put(memo_key, data, fresh_seconds)
+    with _flight_lock:
+        _inflight.pop(memo_key, None)
+    future.set_result(data)
     return data
 
 
@@ -53,8 +471,9 @@ def get_clan(
     sleep_seconds: float,
     cache_dir: str,
     ttl_seconds: int,
+    memo: Optional[RunMemo] = None,
 ):
-    return _get_cached("clans", clan_tag, token, sleep_seconds, cache_dir, ttl_seconds)
+    return _get_cached("clans", clan_tag, token, sleep_seconds, cache_dir, ttl_seconds, memo)
 
 
 def get_members(
@@ -63,6 +482,7 @@ def get_members(
     sleep_seconds: float,
     cache_dir: str,
     ttl_seconds: int,
+    memo: Optional[RunMemo] = None,
 ):
     data = _get_cached(
         "clans",
@@ -71,6 +491,7 @@ def get_members(
         sleep_seconds,
         cache_dir,
         ttl_seconds,
+        memo,
     )
     return data.get("items", [])
 
@@ -81,28 +502,97 @@ def get_player(
     sleep_seconds: float,
     cache_dir: str,
     ttl_seconds: int,
+    memo: Optional[RunMemo] = None,
 ):
-    return _get_cached("players", player_tag, token, sleep_seconds, cache_dir, ttl_seconds)
+    return _get_cached("players", player_tag, token, sleep_seconds, cache_dir, ttl_seconds, memo)
 
 
-def get_warlog(
+def cached_players(
+    player_tags: List[str],
+    cache_dir: str,
+    ttl_seconds: int,
+    memo: Optional[RunMemo] = None,
+) -> Tuple[Dict[str, Any], List[str]]:
+    # Memo hits plus one bulk cache read for the rest of the roster. Returns the
+    # resolved payloads by tag and the unique tags that still need get_player.
+    memo = _run_memo if memo is None else memo
+    results: Dict[str, Any] = {}
+    for tag in player_tags:
+        data = memo.get((cache_dir, f"players_{tag}"))
+        if data is not _MISSING:
+            metrics.inc("memo_lookups_total", result="hit")
+            results[tag] = data
+    unread = list(dict.fromkeys(tag for tag in player_tags if tag not in results))
+    entries = cache_get_many(cache_dir, [f"players_{tag}" for tag in unread])
+    missing = []
+    for tag in unread:
+        entry = entries.get(f"players_{tag}")
+        staleness = entry_staleness(entry, ttl_seconds) if entry is not None else None
+        if staleness is not None and staleness <= 0:
+            metrics.inc("cache_lookups_total", result="hit")
+            results[tag] = entry.get("data")
+            memo.put((cache_dir, f"players_{tag}"), results[tag], -staleness)
+        else:
+            missing.append(tag)
+    return results, missing
+
+
+def get_players(
+    player_tags: List[str],
+    token: str,
+    sleep_seconds: float,
+    cache_dir: str,
+    ttl_seconds: int,
+    max_workers: int = 8,
+    memo: Optional[RunMemo] = None,
+) -> List[Dict[str, Any]]:
+    # Only cache misses go to the pool.
+    results, missing = cached_players(player_tags, cache_dir, ttl_seconds, memo)
+
+    def fetch(tag):
+        return get_player(tag, token, sleep_seconds, cache_dir, ttl_seconds, memo)
+
+    if max_workers <= 1 or len(missing) <= 1:
+        results.update({tag: fetch(tag) for tag in missing})
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results.update(zip(missing, executor.map(fetch, missing)))
+    return [results[tag] for tag in player_tags]
+
+
+def get_warlog_page(
     clan_tag: str,
     token: str,
     sleep_seconds: float,
     cache_dir: str,
     ttl_seconds: int,
+    limit: int = 25,
+    after: Optional[str] = None,
+    memo: Optional[RunMemo] = None,
 ) -> Optional[Dict[str, Any]]:
+    tag = f"{clan_tag}/warlog?limit={limit}"
+    if after:
+        tag += f"&after={quote(after, safe='')}"
     try:
-        return _get_cached(
-            "clans",
-            f"{clan_tag}/warlog?limit=25",
-            token,
-            sleep_seconds,
-            cache_dir,
-            ttl_seconds,
-        )
-    except RuntimeError:
-        return None
+        return _get_cached("clans", tag, token, sleep_seconds, cache_dir, ttl_seconds, memo)
+    except ApiError as error:
+        # Private or missing war logs degrade the snapshot; outages still fail.
+        if error.status in (403, 404):
+            return None
+        raise
+
+
+def get_warlog(
+    clan_tag: str,
+    token: str,
+    sleep_seconds: float,
+    cache_dir: str,
+    ttl_seconds: int,
+    memo: Optional[RunMemo] = None,
+) -> Optional[Dict[str, Any]]:
+    return get_warlog_page(
+        clan_tag, token, sleep_seconds, cache_dir, ttl_seconds, memo=memo
+    )
 
 
 def get_current_war(
@@ -111,6 +601,8 @@ def get_current_war(
     sleep_seconds: float,
     cache_dir: str,
     ttl_seconds: int,
+    memo: Optional[RunMemo] = None,
+    revalidate: bool = False,
 ):
     return _get_cached(
         "clans",
@@ -119,6 +611,32 @@ def get_current_war(
         sleep_seconds,
         cache_dir,
         ttl_seconds,
+        memo,
+        revalidate,
+    )
+
+
+def configure_api_base(base_url: str) -> None:
+    global API_BASE
+    API_BASE = base_url.rstrip("/")
+
+
+def configure_from_config(config: Dict[str, Any]) -> None:
+    max_workers = int(config.get("maxWorkers", 8))
+    if config.get("apiBaseUrl"):
+        configure_api_base(config["apiBaseUrl"])
+    configure_backend(config.get("cacheBackend", "file"), config.get("cacheCompression", "none"))
+    if config.get("requestsPerSecond"):
+        configure_rate_limit(float(config["requestsPerSecond"]))
+    configure_stale_while_revalidate(float(config.get("staleWhileRevalidateSeconds", 0)))
+    configure_session(int(config.get("httpPoolSize", max_workers)))
+    configure_retries(
+        int(config.get("maxRetries", 3)),
+        float(config.get("retryBaseSeconds", 0.5)),
+        float(config.get("retryMaxSeconds", 30)),
+        float(config.get("retryBudgetRatio", 0.2)),
+        int(config.get("circuitBreakerThreshold", 5)),
+        float(config.get("circuitBreakerCooldownSeconds", 30)),
     )
 
 
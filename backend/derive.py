@@ -1,7 +1,8 @@
-from collections import defaultdict
 from statistics import mean
 from typing import Dict, List
 
+import numpy as np
+
 
 def pct(level, max_level):
     if not level or not max_level:
@@ -9,6 +10,17 @@ def pct(level, max_level):
     return level / max_level
 
 
+def exact_mean(values) -> float:
+    # statistics.mean semantics (exact sum, a single rounding) without its
+    # Fraction overhead: float denominators are powers of two, so the sum is
+    # exact in integers and int / int true division rounds once. fsum(v) / n
+    # rounds twice and can land one ulp away, which shows up after round(_, 4).
+    ratios = [value.as_integer_ratio() for value in values]
+    scale = max(denominator for _, denominator in ratios)
+    total = sum(numerator * (scale // denominator) for numerator, denominator in ratios)
+    return total / (scale * len(ratios))
+
+
 def power_index(profile: Dict, category: str) -> float:
     values = []
     for unit in profile.get("categories", {}).get(category, []):
@@ -74,29 +86,166 @@ def super_active_count(profile: Dict) -> int:
     return count
 
 
-def _collect_unit_stats(profiles: List[Dict], category: str):
-    totals = defaultdict(list)
-    for profile in profiles:
-        for unit in profile.get("categories", {}).get(category, []):
-            value = pct(unit.get("level"), unit.get("maxLevel"))
-            if value is not None:
-                totals[unit.get("name")].append(value)
-    return totals
+def category_metrics(
+    units: List[Dict],
+    research_threshold: float = 0.8,
+    near_max_threshold: float = 0.9,
+    limit: int = 10,
+):
+    # Single pass over a category: every metric below reuses the same pct value
+    # and the same (pct, level) ranking, matching the per-metric helpers above.
+    values = []
+    rows = []
+    for unit in units:
+        level = unit.get("level")
+        max_level = unit.get("maxLevel")
+        value = pct(level, max_level)
+        if value is None:
+            continue
+        values.append(value)
+        rows.append(
+            (
+                value,
+                {
+                    "name": unit.get("name"),
+                    "level": level,
+                    "maxLevel": max_level,
+                    "pct": round(value, 4),
+                },
+            )
+        )
+    near_max = [
+        {"name": item["name"], "pct": item["pct"]}
+        for value, item in rows
+        if value >= near_max_threshold
+    ]
+    near_max.sort(key=lambda item: item["pct"], reverse=True)
+    ranked = sorted(rows, key=lambda row: (row[1]["pct"], row[1]["level"]), reverse=True)
+    return {
+        "powerIndex": round(mean(values), 4) if values else 0.0,
+        "topNearMax": near_max[:limit],
+        "topResearch": [item for value, item in ranked if value >= research_threshold][:limit],
+        "nearMaxUnits": [item for value, item in ranked if value >= near_max_threshold],
+        "maxUnits": [item for value, item in ranked if value >= 1.0],
+    }
 
 
-def top_units_by_category(profiles: List[Dict], category: str):
-    totals = _collect_unit_stats(profiles, category)
+def profile_metrics(profile: Dict, **options):
+    categories = profile.get("categories", {})
+    metrics = {
+        category: category_metrics(units, **options) for category, units in categories.items()
+    }
+    super_active = [
+        {"name": unit.get("name"), "level": unit.get("level")}
+        for unit in categories.get("troops", [])
+        if unit.get("superActive")
+    ]
+    return metrics, super_active
+
+
+# Columnar players x units view of one category, built once per roster. Cells are
+# NaN where a player lacks the unit (or it has no usable maxLevel); columns follow
+# first appearance across the roster, like the dict-based collection they replace.
+class UnitMatrix:
+    def __init__(self, players, units, level, max_level, pct_raw, pct_rounded):
+        self.players = players
+        self.units = units
+        self.level = level
+        self.max_level = max_level
+        self.pct = pct_raw
+        self.pct_rounded = pct_rounded
+        self.valid = ~np.isnan(pct_raw)
+        self.counts = self.valid.sum(axis=0)
+        self._average_pct = None
+
+    @classmethod
+    def from_profiles(cls, profiles: List[Dict], category: str) -> "UnitMatrix":
+        index: Dict[str, int] = {}
+        rows, cols, levels, max_levels, values, rounded = [], [], [], [], [], []
+        for row, profile in enumerate(profiles):
+            for unit in profile.get("categories", {}).get(category, []):
+                level = unit.get("level")
+                max_level = unit.get("maxLevel")
+                value = pct(level, max_level)
+                if value is None:
+                    continue
+                rows.append(row)
+                cols.append(index.setdefault(unit.get("name"), len(index)))
+                levels.append(level)
+                max_levels.append(max_level)
+                values.append(value)
+                # Python's round keeps ties identical to the per-unit helpers.
+                rounded.append(round(value, 4))
+        shape = (len(profiles), len(index))
+        matrices = [np.full(shape, np.nan) for _ in range(4)]
+        for matrix, data in zip(matrices, (levels, max_levels, values, rounded)):
+            matrix[rows, cols] = data
+        players = [
+            {"name": profile.get("name"), "tag": profile.get("tag")} for profile in profiles
+        ]
+        return cls(players, list(index), *matrices)
+
+    @property
+    def total_players(self) -> int:
+        return max(len(self.players), 1)
+
+    def average_pct(self):
+        # Per column exact_mean rather than nansum / counts, so the averages
+        # match the incremental snapshot path bit for bit.
+        if self._average_pct is None:
+            self._average_pct = np.array(
+                [
+                    exact_mean(self.pct[self.valid[:, col], col].tolist())
+                    for col in range(len(self.units))
+                ]
+            )
+        return self._average_pct
+
+    def averages(self) -> Dict[str, float]:
+        return dict(zip(self.units, self.average_pct().tolist()))
+
+    def top_units(self):
+        return top_unit_rows(self.units, self.counts, self.average_pct(), self.total_players)
+
+    def coverage(self):
+        coverage90 = (np.nan_to_num(self.pct, nan=0.0) >= 0.9).sum(axis=0)
+        return coverage_rows(self.units, coverage90, self.average_pct(), self.total_players)
+
+    def top_donors(self, limit: int = 3):
+        if not self.units or not self.players:
+            return {}
+        # Stable lexsort on negated keys == sort by (pct, level) descending with
+        # ties left in roster order; missing cells sink to the end.
+        pct_key = np.where(self.valid, -self.pct_rounded, np.inf).T
+        level_key = np.where(self.valid, -self.level, np.inf).T
+        order = np.lexsort((level_key, pct_key), axis=-1)[:, :limit]
+        results = {}
+        for col, unit in enumerate(self.units):
+            entries = []
+            for row in order[col]:
+                if not self.valid[row, col]:
+                    break
+                entries.append(
+                    {
+                        **self.players[row],
+                        "level": int(self.level[row, col]),
+                        "maxLevel": int(self.max_level[row, col]),
+                        "pct": float(self.pct_rounded[row, col]),
+                    }
+                )
+            results[unit] = entries
+        return results
+
+
+def top_unit_rows(units, counts, avg_pcts, total_players: int):
     results = []
-    total_players = max(len(profiles), 1)
-    for unit_name, values in totals.items():
-        avg_pct = mean(values)
-        availability = len(values) / total_players
-        strength = avg_pct * availability
+    for unit, count, avg_pct in zip(units, counts, avg_pcts):
+        availability = int(count) / total_players
         results.append(
             {
-                "unit": unit_name,
-                "strength": round(strength, 4),
-                "avgPct": round(avg_pct, 4),
+                "unit": unit,
+                "strength": round(float(avg_pct) * availability, 4),
+                "avgPct": round(float(avg_pct), 4),
                 "availability": round(availability, 4),
             }
         )
@@ -104,48 +253,48 @@ def top_units_by_category(profiles: List[Dict], category: str):
     return results
 
 
-def coverage(profiles: List[Dict], category: str):
-    totals = _collect_unit_stats(profiles, category)
-    results = []
-    total_players = max(len(profiles), 1)
-    for unit_name, values in totals.items():
-        coverage90 = sum(1 for value in values if value >= 0.9)
-        avg_pct = mean(values)
-        results.append(
-            {
-                "unit": unit_name,
-                "coverage90": coverage90,
-                "coverageRate": round(coverage90 / total_players, 4),
-                "avgPct": round(avg_pct, 4),
-            }
-        )
+def coverage_rows(units, coverage90s, avg_pcts, total_players: int):
+    results = [
+        {
+            "unit": unit,
+            "coverage90": int(coverage90),
+            "coverageRate": round(int(coverage90) / total_players, 4),
+            "avgPct": round(float(avg_pct), 4),
+        }
+        for unit, coverage90, avg_pct in zip(units, coverage90s, avg_pcts)
+    ]
     results.sort(key=lambda item: (item["coverage90"], item["avgPct"]), reverse=True)
     return results
 
 
+def unit_gaps(clan: UnitMatrix, opponent: UnitMatrix, limit: int = 10):
+    units = list(dict.fromkeys(clan.units + opponent.units))
+    clan_avg = np.zeros(len(units))
+    opponent_avg = np.zeros(len(units))
+    position = {unit: col for col, unit in enumerate(units)}
+    if clan.units:
+        clan_avg[[position[unit] for unit in clan.units]] = clan.average_pct()
+    if opponent.units:
+        opponent_avg[[position[unit] for unit in opponent.units]] = opponent.average_pct()
+    gaps = clan_avg - opponent_avg
+    order = np.argsort(-np.abs(gaps), kind="stable")[:limit]
+    return [{"unit": units[col], "gapPct": round(float(gaps[col]), 4)} for col in order]
+
+
+def roster_matrices(profiles: List[Dict], categories) -> Dict[str, UnitMatrix]:
+    return {category: UnitMatrix.from_profiles(profiles, category) for category in categories}
+
+
+def top_units_by_category(profiles: List[Dict], category: str):
+    return UnitMatrix.from_profiles(profiles, category).top_units()
+
+
+def coverage(profiles: List[Dict], category: str):
+    return UnitMatrix.from_profiles(profiles, category).coverage()
+
+
 def top_donors_by_category(profiles: List[Dict], category: str, limit: int = 3):
-    donors = defaultdict(list)
-    for profile in profiles:
-        for unit in profile.get("categories", {}).get(category, []):
-            level = unit.get("level")
-            max_level = unit.get("maxLevel")
-            value = pct(level, max_level)
-            if value is None:
-                continue
-            donors[unit.get("name")].append(
-                {
-                    "name": profile.get("name"),
-                    "tag": profile.get("tag"),
-                    "level": level,
-                    "maxLevel": max_level,
-                    "pct": round(value, 4),
-                }
-            )
-    results = {}
-    for unit_name, entries in donors.items():
-        entries.sort(key=lambda item: (item["pct"], item["level"]), reverse=True)
-        results[unit_name] = entries[:limit]
-    return results
+    return UnitMatrix.from_profiles(profiles, category).top_donors(limit)
 
 
 def coverage_gaps(coverage_rows: List[Dict], threshold: float = 0.2, limit: int = 20):
@@ -154,6 +303,40 @@ def coverage_gaps(coverage_rows: List[Dict], threshold: float = 0.2, limit: int
     return gaps[:limit]
 
 
+def upgrade_candidates(profile: Dict, min_pct: float = 0.85, max_pct: float = 0.95):
+    candidates = []
+    for category, units in profile.get("categories", {}).items():
+        for unit in units:
+            value = pct(unit.get("level"), unit.get("maxLevel"))
+            if value is None or value < min_pct or value > max_pct:
+                continue
+            candidates.append((category, unit.get("name"), value))
+    return candidates
+
+
+def suggest_upgrades(
+    candidates,
+    coverage_map: Dict[str, Dict[str, float]],
+    coverage_threshold: float = 0.2,
+    max_per_player: int = 3,
+):
+    suggestions = []
+    for category, unit_name, value in candidates:
+        coverage_rate = coverage_map.get(category, {}).get(unit_name, 1)
+        if coverage_rate > coverage_threshold:
+            continue
+        suggestions.append(
+            {
+                "unit": unit_name,
+                "category": category,
+                "pct": round(value, 4),
+                "coverageRate": round(coverage_rate, 4),
+            }
+        )
+    suggestions.sort(key=lambda item: (item["coverageRate"], -item["pct"]))
+    return suggestions[:max_per_player]
+
+
 def recommend_upgrades(
     profiles: List[Dict],
     coverage_map: Dict[str, Dict[str, float]],
@@ -164,29 +347,17 @@ def recommend_upgrades(
 ):
     recommendations = []
     for profile in profiles:
-        suggestions = []
-        for category, units in profile.get("categories", {}).items():
-            for unit in units:
-                value = pct(unit.get("level"), unit.get("maxLevel"))
-                if value is None or value < min_pct or value > max_pct:
-                    continue
-                coverage_rate = coverage_map.get(category, {}).get(unit.get("name"), 1)
-                if coverage_rate > coverage_threshold:
-                    continue
-                suggestions.append(
-                    {
-                        "unit": unit.get("name"),
-                        "category": category,
-                        "pct": round(value, 4),
-                        "coverageRate": round(coverage_rate, 4),
-                    }
-                )
+        suggestions = suggest_upgrades(
+            upgrade_candidates(profile, min_pct, max_pct),
+            coverage_map,
+            coverage_threshold,
+            max_per_player,
+        )
         if suggestions:
-            suggestions.sort(key=lambda item: (item["coverageRate"], -item["pct"]))
             recommendations.append(
                 {
                     "player": {"name": profile.get("name"), "tag": profile.get("tag")},
-                    "suggestions": suggestions[:max_per_player],
+                    "suggestions": suggestions,
                 }
             )
     return recommendations
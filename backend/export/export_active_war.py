@@ -1,13 +1,28 @@
 import argparse
 import json
 import os
-from collections import defaultdict
 from datetime import datetime, timezone
-from statistics import mean
 
-from .. import coc_api
-from ..derive import pct, top_units_by_category
-from .export_clan_snapshot import build_profile
+from .. import coc_api, metrics
+from ..cache import prune_from_config
+from ..derive import UnitMatrix, roster_matrices, unit_gaps
+from .export_clan_snapshot import (
+    build_profile,
+    member_shard,
+    member_shard_name,
+    prune_member_shards,
+)
+from .output import (
+    configure_output_from_config,
+    remove_output,
+    write_output,
+    write_run_metrics,
+)
+
+COMBAT_CATEGORIES = ("troops", "spells", "heroes", "heroEquipment")
+SHARD_DIR = "war"
+# The matchup cards only draw power bars.
+INDEX_DERIVED_KEYS = ("powerIndex",)
 
 
 def load_config(path: str):
@@ -16,41 +31,28 @@ def load_config(path: str):
 
 
 def average_units(profiles, category):
-    totals = defaultdict(list)
-    for profile in profiles:
-        for unit in profile.get("categories", {}).get(category, []):
-            value = pct(unit.get("level"), unit.get("maxLevel"))
-            if value is not None:
-                totals[unit.get("name")].append(value)
-    return {name: mean(values) for name, values in totals.items()}
+    return UnitMatrix.from_profiles(profiles, category).averages()
 
 
 def compute_gaps(clan_profiles, opponent_profiles, category, limit=10):
-    clan_avg = average_units(clan_profiles, category)
-    opponent_avg = average_units(opponent_profiles, category)
-    units = set(clan_avg.keys()) | set(opponent_avg.keys())
-    gaps = []
-    for unit in units:
-        clan_value = clan_avg.get(unit, 0)
-        opponent_value = opponent_avg.get(unit, 0)
-        gap = clan_value - opponent_value
-        gaps.append({"unit": unit, "gapPct": round(gap, 4)})
-    gaps.sort(key=lambda item: abs(item["gapPct"]), reverse=True)
-    return gaps[:limit]
-
-
-def build_team(team_json, side, token, sleep_seconds, cache_dir, cache_ttl):
+    return unit_gaps(
+        UnitMatrix.from_profiles(clan_profiles, category),
+        UnitMatrix.from_profiles(opponent_profiles, category),
+        limit,
+    )
+
+
+@metrics.timed("assemble_team")
+def assemble_team(team_json, side, profiles_by_tag):
     members = []
     for member in team_json.get("members", []):
         tag = member.get("tag")
-        profile_json = coc_api.get_player(tag, token, sleep_seconds, cache_dir, cache_ttl)
-        profile = build_profile(profile_json)
         members.append(
             {
                 "tag": tag,
                 "name": member.get("name"),
                 "mapPosition": member.get("mapPosition"),
-                "profile": profile,
+                "profile": profiles_by_tag[tag],
                 "warMember": {"attacks": member.get("attacks", [])},
             }
         )
@@ -62,13 +64,119 @@ def build_team(team_json, side, token, sleep_seconds, cache_dir, cache_ttl):
     }
 
 
+def build_team(team_json, side, token, sleep_seconds, cache_dir, cache_ttl, max_workers=8):
+    tags = [member.get("tag") for member in team_json.get("members", [])]
+    player_jsons = coc_api.get_players(
+        tags, token, sleep_seconds, cache_dir, cache_ttl, max_workers
+    )
+    profiles_by_tag = {
+        tag: build_profile(profile_json) for tag, profile_json in zip(tags, player_jsons)
+    }
+    return assemble_team(team_json, side, profiles_by_tag)
+
+
 def build_threats(profiles):
     return {
-        "troops": top_units_by_category(profiles, "troops"),
-        "spells": top_units_by_category(profiles, "spells"),
-        "heroes": top_units_by_category(profiles, "heroes"),
-        "heroEquipment": top_units_by_category(profiles, "heroEquipment"),
+        category: matrix.top_units()
+        for category, matrix in roster_matrices(profiles, COMBAT_CATEGORIES).items()
+    }
+
+
+@metrics.timed("build_war_payload")
+def build_war_payload(state, teams):
+    derived = {"topThreats": {}, "gaps": {}}
+
+    if teams:
+        clan_team, opponent_team = teams
+        clan_matrices = roster_matrices(
+            [member["profile"] for member in clan_team["members"]], COMBAT_CATEGORIES
+        )
+        opponent_matrices = roster_matrices(
+            [member["profile"] for member in opponent_team["members"]], COMBAT_CATEGORIES
+        )
+
+        derived["topThreats"] = {
+            "clan": {category: matrix.top_units() for category, matrix in clan_matrices.items()},
+            "opponent": {
+                category: matrix.top_units() for category, matrix in opponent_matrices.items()
+            },
+        }
+        derived["gaps"] = {
+            category: unit_gaps(clan_matrices[category], opponent_matrices[category])
+            for category in COMBAT_CATEGORIES
+        }
+
+    return {
+        "meta": {
+            "generatedAt": datetime.now(timezone.utc).isoformat(),
+            "state": state or "unknown",
+        },
+        "teams": teams,
+        "derived": derived,
+    }
+
+
+def war_index_row(profile):
+    derived = profile.get("derived", {})
+    return {
+        "tag": profile.get("tag"),
+        "name": profile.get("name"),
+        "th": profile.get("th"),
+        "derived": {key: derived.get(key) for key in INDEX_DERIVED_KEYS},
+    }
+
+
+@metrics.timed("build_war_shards")
+def build_war_shards(payload):
+    # summary.json is what war.js paints first: matchups with each member's
+    # index row (power bars), threats and gaps. Full profiles of both sides are
+    # fetched from members/ only when a matchup is compared.
+    teams = [
+        {
+            **team,
+            "members": [
+                {**member, "profile": war_index_row(member["profile"])}
+                for member in team["members"]
+            ],
+        }
+        for team in payload["teams"]
+    ]
+    shards = {
+        "summary.json": {"meta": payload["meta"], "teams": teams, "derived": payload["derived"]}
     }
+    for team in payload["teams"]:
+        for member in team["members"]:
+            name = member_shard_name(member.get("tag") or "")
+            shards[f"members/{name}"] = member_shard(member["profile"])
+    return shards
+
+
+def write_war_shards(war_path: str, payload):
+    shard_dir = os.path.join(os.path.dirname(war_path), SHARD_DIR)
+    shards = build_war_shards(payload)
+    written = []
+    for name, shard in shards.items():
+        path = os.path.join(shard_dir, *name.split("/"))
+        if write_output(path, shard):
+            written.append(path)
+    current = {name[len("members/") :] for name in shards if name.startswith("members/")}
+    prune_member_shards(os.path.join(shard_dir, "members"), current)
+    return written
+
+
+def remove_war_shards(war_path: str) -> None:
+    shard_dir = os.path.join(os.path.dirname(war_path), SHARD_DIR)
+    remove_output(os.path.join(shard_dir, "summary.json"))
+    prune_member_shards(os.path.join(shard_dir, "members"), set())
+
+
+def write_war_payload(war_path: str, payload, config):
+    written = [war_path] if write_output(war_path, payload) else []
+    if config.get("shardedOutputs", True):
+        written.extend(write_war_shards(war_path, payload))
+    else:
+        remove_war_shards(war_path)
+    return written
 
 
 def main():
@@ -92,58 +200,43 @@ def main():
     sleep_seconds = float(config.get("sleepSeconds", 0.25))
     cache_ttl = int(config.get("cacheTtlSeconds", 3600))
     cache_dir = os.path.join(os.path.dirname(__file__), "..", "cache")
+    max_workers = int(config.get("maxWorkers", 8))
+    coc_api.configure_from_config(config)
+    coc_api.reset_run_memo()
+    configure_output_from_config(config)
 
     war_json = coc_api.get_current_war(clan_tag, token, sleep_seconds, cache_dir, cache_ttl)
     state = war_json.get("state") if war_json else None
 
-    teams = []
-    derived = {"topThreats": {}, "gaps": {}}
-
     if war_json and state not in (None, "notInWar"):
-        clan_team = build_team(
-            war_json.get("clan", {}),
-            "clan",
-            token,
-            sleep_seconds,
-            cache_dir,
-            cache_ttl,
-        )
-        opponent_team = build_team(
-            war_json.get("opponent", {}),
-            "opponent",
-            token,
-            sleep_seconds,
-            cache_dir,
-            cache_ttl,
-        )
-        teams = [clan_team, opponent_team]
-
-        clan_profiles = [member["profile"] for member in clan_team["members"]]
-        opponent_profiles = [member["profile"] for member in opponent_team["members"]]
-
-        derived["topThreats"] = {
-            "clan": build_threats(clan_profiles),
-            "opponent": build_threats(opponent_profiles),
-        }
-        derived["gaps"] = {
-            "troops": compute_gaps(clan_profiles, opponent_profiles, "troops"),
-            "spells": compute_gaps(clan_profiles, opponent_profiles, "spells"),
-            "heroes": compute_gaps(clan_profiles, opponent_profiles, "heroes"),
-            "heroEquipment": compute_gaps(clan_profiles, opponent_profiles, "heroEquipment"),
-        }
-
-    payload = {
-        "meta": {
-            "generatedAt": datetime.now(timezone.utc).isoformat(),
-            "state": state or "unknown",
-        },
-        "teams": teams,
-        "derived": derived,
-    }
-
-    os.makedirs(os.path.dirname(args.output), exist_ok=True)
-    with open(args.output, "w", encoding="utf-8") as handle:
-        json.dump(payload, handle, ensure_ascii=False, indent=2)
+        teams = [
+            build_team(
+                war_json.get("clan", {}),
+                "clan",
+                token,
+                sleep_seconds,
+                cache_dir,
+                cache_ttl,
+                max_workers,
+            ),
+            build_team(
+                war_json.get("opponent", {}),
+                "opponent",
+                token,
+                sleep_seconds,
+                cache_dir,
+                cache_ttl,
+                max_workers,
+            ),
+        ]
+    else:
+        teams = []
+
+    write_war_payload(args.output, build_war_payload(state, teams), config)
+
+    coc_api.wait_for_refreshes()
+    prune_from_config(cache_dir, config)
+    write_run_metrics(config, os.path.dirname(args.output) or ".")
 
 
 if __name__ == "__main__":
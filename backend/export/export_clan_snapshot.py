@@ -3,21 +3,36 @@ import json
 import os
 from datetime import datetime, timezone
 
-from .. import coc_api
+from .. import coc_api, metrics
+from ..cache import prune_from_config
 from ..derive import (
-    coverage,
     coverage_gaps,
-    power_index,
+    coverage_rows,
+    exact_mean,
+    pct,
+    profile_metrics,
     recommend_upgrades,
-    super_active_count,
-    super_active_troops,
-    top_donors_by_category,
-    top_near_max,
-    top_units_by_category,
-    top_units_by_threshold,
-    units_by_threshold,
+    roster_matrices,
+    suggest_upgrades,
+    top_unit_rows,
+    upgrade_candidates,
 )
-from ..normalize import normalize_player
+from ..normalize import normalize_player, profile_source_hash
+from .output import (
+    configure_output_from_config,
+    remove_output,
+    write_json,
+    write_output,
+    write_run_metrics,
+)
+
+AGGREGATE_CATEGORIES = ("troops", "spells", "heroes", "heroEquipment")
+DONOR_CATEGORIES = ("troops", "spells")
+SHARD_DIR = "clan"
+# Legacy aliases kept in clan_snapshot.json only; shards carry the preferred names.
+LEGACY_DERIVED_KEYS = ("topNearMax", "superActiveCount")
+INDEX_DERIVED_KEYS = ("powerIndex", "topResearchByCat", "superActiveTroopsCount")
+SNAPSHOT_STATE_VERSION = 2
 
 
 def load_config(path: str):
@@ -25,47 +40,30 @@ def load_config(path: str):
         return json.load(handle)
 
 
+@metrics.timed("build_profile")
 def build_profile(player_json: dict):
     profile = normalize_player(player_json)
-    top_near_max_by_cat = {
-        "troops": top_near_max(profile, "troops"),
-        "spells": top_near_max(profile, "spells"),
-        "pets": top_near_max(profile, "pets"),
-        "heroes": top_near_max(profile, "heroes"),
-        "heroEquipment": top_near_max(profile, "heroEquipment"),
-    }
-    top_research_by_cat = {
-        "troops": top_units_by_threshold(profile, "troops", 0.8),
-        "pets": top_units_by_threshold(profile, "pets", 0.8),
-        "spells": top_units_by_threshold(profile, "spells", 0.8),
-    }
-    super_active_troops_count = super_active_count(profile)
+    by_category, super_troops = profile_metrics(profile)
+
+    def by_cat(key, categories):
+        return {category: by_category[category][key] for category in categories}
+
+    combat = ("troops", "spells", "heroes", "heroEquipment")
+    top_near_max_by_cat = by_cat(
+        "topNearMax", ("troops", "spells", "pets", "heroes", "heroEquipment")
+    )
+    super_active_troops_count = len(super_troops)
     # Contract note: keep legacy keys (topNearMax, superActiveCount) for backward
     # compatibility while exposing the preferred names (topNearMaxByCat,
     # superActiveTroopsCount). Frontend can migrate to the new keys without breaking.
     derived = {
-        "powerIndex": {
-            "troops": power_index(profile, "troops"),
-            "spells": power_index(profile, "spells"),
-            "heroes": power_index(profile, "heroes"),
-            "heroEquipment": power_index(profile, "heroEquipment"),
-        },
+        "powerIndex": by_cat("powerIndex", combat),
         "topNearMax": top_near_max_by_cat,
         "topNearMaxByCat": top_near_max_by_cat,
-        "topResearchByCat": top_research_by_cat,
-        "nearMaxUnitsByCat": {
-            "troops": units_by_threshold(profile, "troops", 0.9),
-            "spells": units_by_threshold(profile, "spells", 0.9),
-            "heroes": units_by_threshold(profile, "heroes", 0.9),
-            "heroEquipment": units_by_threshold(profile, "heroEquipment", 0.9),
-        },
-        "maxUnitsByCat": {
-            "troops": units_by_threshold(profile, "troops", 1.0),
-            "spells": units_by_threshold(profile, "spells", 1.0),
-            "heroes": units_by_threshold(profile, "heroes", 1.0),
-            "heroEquipment": units_by_threshold(profile, "heroEquipment", 1.0),
-        },
-        "superActiveTroops": super_active_troops(profile),
+        "topResearchByCat": by_cat("topResearch", ("troops", "pets", "spells")),
+        "nearMaxUnitsByCat": by_cat("nearMaxUnits", combat),
+        "maxUnitsByCat": by_cat("maxUnits", combat),
+        "superActiveTroops": super_troops,
         "superActiveCount": super_active_troops_count,
         "superActiveTroopsCount": super_active_troops_count,
     }
@@ -86,84 +84,51 @@ def compute_th_distribution(profiles):
     return distribution
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Export clan snapshot data")
-    parser.add_argument(
-        "--config",
-        default=os.path.join(os.path.dirname(__file__), "..", "config.example.json"),
-    )
-    parser.add_argument(
-        "--output",
-        default=os.path.join(os.path.dirname(__file__), "..", "outputs", "clan_snapshot.json"),
-    )
-    args = parser.parse_args()
-
-    config = load_config(args.config)
-    clan_tag = config.get("clanTag")
-    if not clan_tag:
-        raise RuntimeError("Config missing clanTag")
-
-    token = coc_api.read_token(config.get("tokenEnvVar", "COC_API_TOKEN"))
-    sleep_seconds = float(config.get("sleepSeconds", 0.25))
-    cache_ttl = int(config.get("cacheTtlSeconds", 3600))
-    cache_dir = os.path.join(os.path.dirname(__file__), "..", "cache")
-
-    clan = coc_api.get_clan(clan_tag, token, sleep_seconds, cache_dir, cache_ttl)
-    members = coc_api.get_members(clan_tag, token, sleep_seconds, cache_dir, cache_ttl)
+def coverage_rate_map(coverage_by_cat):
+    return {
+        category: {item.get("unit"): item.get("coverageRate", 0) for item in rows}
+        for category, rows in coverage_by_cat.items()
+    }
 
-    profiles = []
-    for member in members:
-        profile_json = coc_api.get_player(
-            member.get("tag"), token, sleep_seconds, cache_dir, cache_ttl
-        )
-        profiles.append(build_profile(profile_json))
-
-    warlog = None
-    if config.get("includeWarlog"):
-        warlog = coc_api.get_warlog(clan_tag, token, sleep_seconds, cache_dir, cache_ttl)
 
+def assemble_aggregates(profiles, top_units_by_cat, coverage_by_cat, top_donors, recommendations):
     th_values = [profile.get("th") for profile in profiles if profile.get("th")]
     th_avg = round(sum(th_values) / len(th_values), 2) if th_values else 0
-
-    coverage_by_cat = {
-        "troops": coverage(profiles, "troops"),
-        "spells": coverage(profiles, "spells"),
-        "heroes": coverage(profiles, "heroes"),
-        "heroEquipment": coverage(profiles, "heroEquipment"),
-    }
-    coverage_map = {
-        category: {item.get("unit"): item.get("coverageRate", 0) for item in rows}
-        for category, rows in coverage_by_cat.items()
-    }
-    aggregates = {
+    return {
         "thAvg": th_avg,
         "thDistribution": compute_th_distribution(profiles),
-        "topUnitsByCat": {
-            "troops": top_units_by_category(profiles, "troops"),
-            "spells": top_units_by_category(profiles, "spells"),
-            "heroes": top_units_by_category(profiles, "heroes"),
-            "heroEquipment": top_units_by_category(profiles, "heroEquipment"),
-        },
+        "topUnitsByCat": top_units_by_cat,
         "coverage": coverage_by_cat,
         "resources": {
-            "topDonors": {
-                "troops": top_donors_by_category(profiles, "troops"),
-                "spells": top_donors_by_category(profiles, "spells"),
-            },
+            "topDonors": top_donors,
             "coverageGaps": {
-                "troops": coverage_gaps(coverage_by_cat["troops"]),
-                "spells": coverage_gaps(coverage_by_cat["spells"]),
-                "heroes": coverage_gaps(coverage_by_cat["heroes"]),
-                "heroEquipment": coverage_gaps(coverage_by_cat["heroEquipment"]),
+                category: coverage_gaps(rows) for category, rows in coverage_by_cat.items()
             },
-            "recommendations": recommend_upgrades(profiles, coverage_map),
+            "recommendations": recommendations,
             "note": (
                 "Recomendaciones heurísticas basadas en cobertura (sin datos reales de laboratorio)."
             ),
         },
     }
 
-    clan_payload = {
+
+@metrics.timed("build_aggregates")
+def build_aggregates(profiles):
+    matrices = roster_matrices(profiles, AGGREGATE_CATEGORIES)
+    coverage_by_cat = {category: matrix.coverage() for category, matrix in matrices.items()}
+    return assemble_aggregates(
+        profiles,
+        {category: matrix.top_units() for category, matrix in matrices.items()},
+        coverage_by_cat,
+        {category: matrices[category].top_donors() for category in DONOR_CATEGORIES},
+        recommend_upgrades(profiles, coverage_rate_map(coverage_by_cat)),
+    )
+
+
+def build_snapshot(clan_tag, clan, profiles, warlog=None, aggregates=None):
+    if aggregates is None:
+        aggregates = build_aggregates(profiles)
+    return {
         "meta": {
             "generatedAt": datetime.now(timezone.utc).isoformat(),
             "source": "api",
@@ -183,9 +148,304 @@ def main():
         "aggregates": aggregates,
     }
 
-    os.makedirs(os.path.dirname(args.output), exist_ok=True)
-    with open(args.output, "w", encoding="utf-8") as handle:
-        json.dump(clan_payload, handle, ensure_ascii=False, indent=2)
+
+def member_shard_name(tag: str) -> str:
+    return f"{tag.replace('#', '')}.json"
+
+
+def member_shard(profile):
+    derived = profile.get("derived", {})
+    return {
+        **profile,
+        "derived": {key: value for key, value in derived.items() if key not in LEGACY_DERIVED_KEYS},
+    }
+
+
+def member_index_row(profile):
+    derived = profile.get("derived", {})
+    return {
+        "tag": profile.get("tag"),
+        "name": profile.get("name"),
+        "th": profile.get("th"),
+        "expLevel": profile.get("expLevel"),
+        "derived": {key: derived.get(key) for key in INDEX_DERIVED_KEYS},
+    }
+
+
+@metrics.timed("build_snapshot_shards")
+def build_snapshot_shards(snapshot):
+    # summary.json is all the roster page needs for its first paint; the
+    # aggregates and each member's full profile are fetched only when shown.
+    clan = {key: value for key, value in snapshot["clan"].items() if key != "warlog"}
+    clan["hasWarlog"] = snapshot["clan"].get("warlog") is not None
+    aggregates = snapshot["aggregates"]
+    shards = {
+        "summary.json": {
+            "meta": snapshot["meta"],
+            "clan": clan,
+            "aggregates": {
+                "thAvg": aggregates.get("thAvg"),
+                "thDistribution": aggregates.get("thDistribution"),
+            },
+            "members": [member_index_row(profile) for profile in snapshot["members"]],
+        },
+        "aggregates.json": {"meta": snapshot["meta"], "aggregates": aggregates},
+    }
+    for profile in snapshot["members"]:
+        shards[f"members/{member_shard_name(profile.get('tag', ''))}"] = member_shard(profile)
+    return shards
+
+
+def prune_member_shards(members_dir: str, keep) -> None:
+    if not os.path.isdir(members_dir):
+        return
+    for entry in os.scandir(members_dir):
+        name = entry.name[: -len(".gz")] if entry.name.endswith(".gz") else entry.name
+        if name.endswith(".json") and name not in keep:
+            remove_output(os.path.join(members_dir, name))
+
+
+def write_snapshot_shards(snapshot_path: str, snapshot):
+    shard_dir = os.path.join(os.path.dirname(snapshot_path), SHARD_DIR)
+    written = []
+    for name, payload in build_snapshot_shards(snapshot).items():
+        path = os.path.join(shard_dir, *name.split("/"))
+        if write_output(path, payload):
+            written.append(path)
+    current = {member_shard_name(profile.get("tag", "")) for profile in snapshot["members"]}
+    prune_member_shards(os.path.join(shard_dir, "members"), current)
+    return written
+
+
+def remove_snapshot_shards(snapshot_path: str) -> None:
+    # The pages prefer the shards, so leftovers would hide a newer snapshot.
+    shard_dir = os.path.join(os.path.dirname(snapshot_path), SHARD_DIR)
+    remove_output(os.path.join(shard_dir, "summary.json"))
+    remove_output(os.path.join(shard_dir, "aggregates.json"))
+    prune_member_shards(os.path.join(shard_dir, "members"), set())
+
+
+def write_snapshot(snapshot_path: str, snapshot, config):
+    written = [snapshot_path] if write_output(snapshot_path, snapshot) else []
+    if config.get("shardedOutputs", True):
+        written.extend(write_snapshot_shards(snapshot_path, snapshot))
+    else:
+        remove_snapshot_shards(snapshot_path)
+    return written
+
+
+def snapshot_state_path(output_path: str) -> str:
+    base, _ = os.path.splitext(output_path)
+    return f"{base}.state.json"
+
+
+def _empty_state(clan_tag):
+    return {
+        "version": SNAPSHOT_STATE_VERSION,
+        "clanTag": clan_tag,
+        "members": {},
+        "order": [],
+        "units": {category: {} for category in AGGREGATE_CATEGORIES},
+        "donors": {category: {} for category in DONOR_CATEGORIES},
+    }
+
+
+def load_snapshot_state(path: str, clan_tag: str):
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            state = json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return _empty_state(clan_tag)
+    if state.get("version") != SNAPSHOT_STATE_VERSION or state.get("clanTag") != clan_tag:
+        return _empty_state(clan_tag)
+    return state
+
+
+def save_snapshot_state(path: str, state) -> None:
+    write_json(path, state)
+
+
+def _holdings(profile, category):
+    for index, unit in enumerate(profile.get("categories", {}).get(category, [])):
+        level = unit.get("level")
+        max_level = unit.get("maxLevel")
+        value = pct(level, max_level)
+        if value is not None:
+            yield unit.get("name"), [level, max_level, value, index]
+
+
+def _refresh_unit(unit_state):
+    values = [holding[2] for holding in unit_state["holders"].values()]
+    unit_state["count"] = len(values)
+    # Same averaging routine as UnitMatrix, so the flag never changes a number.
+    unit_state["avgPct"] = exact_mean(values)
+    unit_state["coverage90"] = sum(1 for value in values if value >= 0.9)
+
+
+def _top_donors(unit_state, members, positions, limit=3):
+    ranked = sorted(
+        unit_state["holders"].items(),
+        key=lambda item: (-round(item[1][2], 4), -item[1][0], positions[item[0]]),
+    )
+    return [
+        {
+            "name": members[tag]["profile"].get("name"),
+            "tag": tag,
+            "level": holding[0],
+            "maxLevel": holding[1],
+            "pct": round(holding[2], 4),
+        }
+        for tag, holding in ranked[:limit]
+    ]
+
+
+@metrics.timed("update_snapshot")
+def update_snapshot(state, member_tags, player_jsons):
+    # Only members whose profile inputs changed are normalized and derived again,
+    # and only the units they hold (or held) get their per-unit stats rebuilt.
+    # Everything else in the aggregates is arithmetic over the stored stats.
+    previous = state["members"]
+    members = {}
+    dirty = set(previous) - set(member_tags)
+    for tag, player_json in zip(member_tags, player_jsons):
+        source_hash = profile_source_hash(player_json)
+        entry = previous.get(tag)
+        if entry is None or entry["hash"] != source_hash:
+            profile = build_profile(player_json)
+            entry = {
+                "hash": source_hash,
+                "profile": profile,
+                "candidates": upgrade_candidates(profile),
+            }
+            dirty.add(tag)
+        members[tag] = entry
+
+    positions = {tag: position for position, tag in enumerate(member_tags)}
+    total_players = max(len(member_tags), 1)
+    top_units_by_cat, coverage_by_cat, top_donors = {}, {}, {}
+    for category in AGGREGATE_CATEGORIES:
+        units = state["units"][category]
+        touched = set()
+        for tag in dirty:
+            if tag in previous:
+                for name, _ in _holdings(previous[tag]["profile"], category):
+                    units[name]["holders"].pop(tag, None)
+                    touched.add(name)
+            if tag in members:
+                for name, holding in _holdings(members[tag]["profile"], category):
+                    units.setdefault(name, {"holders": {}})["holders"][tag] = holding
+                    touched.add(name)
+        for name in touched:
+            if units[name]["holders"]:
+                _refresh_unit(units[name])
+            else:
+                del units[name]
+
+        # First appearance in roster order, as a full rebuild would see it.
+        order = sorted(
+            units,
+            key=lambda name: min(
+                (positions[tag], holding[3]) for tag, holding in units[name]["holders"].items()
+            ),
+        )
+        avg_pcts = [units[name]["avgPct"] for name in order]
+        counts = [units[name]["count"] for name in order]
+        coverage90s = [units[name]["coverage90"] for name in order]
+        top_units_by_cat[category] = top_unit_rows(order, counts, avg_pcts, total_players)
+        coverage_by_cat[category] = coverage_rows(order, coverage90s, avg_pcts, total_players)
+
+        if category in DONOR_CATEGORIES:
+            donors = state["donors"][category]
+            # Donor ties are broken by roster position, so a reordered roster
+            # re-ranks every unit (from stored holdings, not from profiles).
+            if state.get("order") != member_tags:
+                touched = set(units) | set(donors)
+            for name in touched:
+                if name in units:
+                    donors[name] = _top_donors(units[name], members, positions)
+                else:
+                    donors.pop(name, None)
+            top_donors[category] = {name: donors[name] for name in order}
+
+    coverage_map = coverage_rate_map(coverage_by_cat)
+    recommendations = []
+    for tag in member_tags:
+        profile = members[tag]["profile"]
+        suggestions = suggest_upgrades(members[tag]["candidates"], coverage_map)
+        if suggestions:
+            recommendations.append(
+                {
+                    "player": {"name": profile.get("name"), "tag": profile.get("tag")},
+                    "suggestions": suggestions,
+                }
+            )
+
+    state["members"] = members
+    state["order"] = list(member_tags)
+    profiles = [members[tag]["profile"] for tag in member_tags]
+    aggregates = assemble_aggregates(
+        profiles, top_units_by_cat, coverage_by_cat, top_donors, recommendations
+    )
+    return profiles, aggregates, len(dirty)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export clan snapshot data")
+    parser.add_argument(
+        "--config",
+        default=os.path.join(os.path.dirname(__file__), "..", "config.example.json"),
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join(os.path.dirname(__file__), "..", "outputs", "clan_snapshot.json"),
+    )
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    clan_tag = config.get("clanTag")
+    if not clan_tag:
+        raise RuntimeError("Config missing clanTag")
+
+    token = coc_api.read_token(config.get("tokenEnvVar", "COC_API_TOKEN"))
+    sleep_seconds = float(config.get("sleepSeconds", 0.25))
+    cache_ttl = int(config.get("cacheTtlSeconds", 3600))
+    cache_dir = os.path.join(os.path.dirname(__file__), "..", "cache")
+    max_workers = int(config.get("maxWorkers", 8))
+    coc_api.configure_from_config(config)
+    coc_api.reset_run_memo()
+    configure_output_from_config(config)
+
+    clan = coc_api.get_clan(clan_tag, token, sleep_seconds, cache_dir, cache_ttl)
+    members = coc_api.get_members(clan_tag, token, sleep_seconds, cache_dir, cache_ttl)
+
+    member_tags = [member.get("tag") for member in members]
+    player_jsons = coc_api.get_players(
+        member_tags,
+        token,
+        sleep_seconds,
+        cache_dir,
+        cache_ttl,
+        max_workers,
+    )
+
+    warlog = None
+    if config.get("includeWarlog"):
+        warlog = coc_api.get_warlog(clan_tag, token, sleep_seconds, cache_dir, cache_ttl)
+
+    if config.get("incrementalSnapshot", True):
+        state_path = snapshot_state_path(args.output)
+        state = load_snapshot_state(state_path, clan_tag)
+        profiles, aggregates, _ = update_snapshot(state, member_tags, player_jsons)
+        clan_payload = build_snapshot(clan_tag, clan, profiles, warlog, aggregates)
+        write_snapshot(args.output, clan_payload, config)
+        save_snapshot_state(state_path, state)
+    else:
+        profiles = [build_profile(profile_json) for profile_json in player_jsons]
+        write_snapshot(args.output, build_snapshot(clan_tag, clan, profiles, warlog), config)
+
+    coc_api.wait_for_refreshes()
+    prune_from_config(cache_dir, config)
+    write_run_metrics(config, os.path.dirname(args.output) or ".")
 
 
 if __name__ == "__main__":
@@ -1,9 +1,25 @@
 import argparse
+import bisect
 import json
 import os
 from datetime import datetime, timezone
 
-from .. import coc_api
+from .. import coc_api, metrics
+from ..cache import prune_from_config
+from .output import (
+    configure_output_from_config,
+    write_json,
+    write_output,
+    write_run_metrics,
+)
+
+EXECUTION_STATE_VERSION = 1
+LEADERBOARDS = (
+    ("mvp", "mvpScore"),
+    ("stars", "totalStars"),
+    ("destruction", "avgDestruction"),
+    ("attacksUsed", "attacksUsed"),
+)
 
 
 def load_config(path: str):
@@ -43,47 +59,55 @@ def summarize_player(stats):
     return summary
 
 
-def build_execution(clan_team, opponent_team):
+def _opponent_index(opponent_team):
     opponent_positions = {
         member.get("tag"): member.get("mapPosition") for member in opponent_team.get("members", [])
     }
     opponent_names = {
         member.get("tag"): member.get("name") for member in opponent_team.get("members", [])
     }
+    return opponent_positions, opponent_names
+
+
+def build_attack(member, attack, opponent_positions, opponent_names):
+    attacker_pos = member.get("mapPosition") or 0
+    defender_tag = attack.get("defenderTag")
+    defender_pos = opponent_positions.get(defender_tag) or 0
+    delta = attacker_pos - defender_pos
+    stars = int(attack.get("stars", 0))
+    destruction = float(attack.get("destructionPercentage", 0))
+    return {
+        "order": attack.get("order"),
+        "attackerTag": member.get("tag"),
+        "attackerName": member.get("name"),
+        "defenderTag": defender_tag,
+        "defenderName": opponent_names.get(defender_tag),
+        "stars": stars,
+        "destruction": destruction,
+        "delta": delta,
+        "mvpScore": score_attack(stars, destruction, delta),
+    }
+
+
+def add_attack(stats, record):
+    stats["attacksUsed"] += 1
+    stats["totalStars"] += record["stars"]
+    stats["totalDestruction"] += record["destruction"]
+    stats["totalDelta"] += record["delta"]
+    stats["mvpScore"] += record["mvpScore"]
+
+
+def build_execution(clan_team, opponent_team):
+    opponent_positions, opponent_names = _opponent_index(opponent_team)
 
     attacks = []
     players = []
     for member in clan_team.get("members", []):
         stats = init_player(member)
-        attacker_pos = member.get("mapPosition") or 0
         for attack in member.get("attacks", []) or []:
-            defender_tag = attack.get("defenderTag")
-            defender_pos = opponent_positions.get(defender_tag) or 0
-            delta = attacker_pos - defender_pos
-            stars = int(attack.get("stars", 0))
-            destruction = float(attack.get("destructionPercentage", 0))
-            order = attack.get("order")
-            mvp_score = score_attack(stars, destruction, delta)
-
-            attacks.append(
-                {
-                    "order": order,
-                    "attackerTag": member.get("tag"),
-                    "attackerName": member.get("name"),
-                    "defenderTag": defender_tag,
-                    "defenderName": opponent_names.get(defender_tag),
-                    "stars": stars,
-                    "destruction": destruction,
-                    "delta": delta,
-                    "mvpScore": mvp_score,
-                }
-            )
-
-            stats["attacksUsed"] += 1
-            stats["totalStars"] += stars
-            stats["totalDestruction"] += destruction
-            stats["totalDelta"] += delta
-            stats["mvpScore"] += mvp_score
+            record = build_attack(member, attack, opponent_positions, opponent_names)
+            attacks.append(record)
+            add_attack(stats, record)
 
         players.append(summarize_player(stats))
 
@@ -96,40 +120,203 @@ def build_leaderboard(players, key, limit=10):
     return sorted(players, key=lambda item: item.get(key, 0), reverse=True)[:limit]
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Export war execution data")
-    parser.add_argument(
-        "--config",
-        default=os.path.join(os.path.dirname(__file__), "..", "config.example.json"),
-    )
-    parser.add_argument(
-        "--output",
-        default=os.path.join(os.path.dirname(__file__), "..", "outputs", "war_execution.json"),
+def war_key(war_json) -> str:
+    return "|".join(
+        str(value or "")
+        for value in (
+            (war_json.get("clan") or {}).get("tag"),
+            (war_json.get("opponent") or {}).get("tag"),
+            war_json.get("preparationStartTime"),
+        )
     )
-    args = parser.parse_args()
 
-    config = load_config(args.config)
-    clan_tag = config.get("clanTag")
-    if not clan_tag:
-        raise RuntimeError("Config missing clanTag")
 
-    token = coc_api.read_token(config.get("tokenEnvVar", "COC_API_TOKEN"))
-    sleep_seconds = float(config.get("sleepSeconds", 0.25))
-    cache_ttl = int(config.get("cacheTtlSeconds", 3600))
-    cache_dir = os.path.join(os.path.dirname(__file__), "..", "cache")
+def execution_state_path(output_path: str) -> str:
+    base, _ = os.path.splitext(output_path)
+    return f"{base}.state.json"
 
-    war_json = coc_api.get_current_war(clan_tag, token, sleep_seconds, cache_dir, cache_ttl)
-    state = war_json.get("state") if war_json else None
 
+def execution_events_path(output_path: str) -> str:
+    base, _ = os.path.splitext(output_path)
+    return f"{base}.events.jsonl"
+
+
+def _rank_entry(summary, key, position):
+    # Sorting these ascending matches sorted(..., reverse=True) on the key with
+    # roster order breaking ties, which is what build_leaderboard produces.
+    return [-summary.get(key, 0), position, summary.get("tag")]
+
+
+def _empty_execution_state(key, members):
+    roster = [member.get("tag") for member in members]
+    summaries = {member.get("tag"): summarize_player(init_player(member)) for member in members}
+    return {
+        "version": EXECUTION_STATE_VERSION,
+        "warKey": key,
+        "roster": roster,
+        "lastOrder": 0,
+        "players": {member.get("tag"): init_player(member) for member in members},
+        "summaries": summaries,
+        "attacks": [],
+        "rankings": {
+            name: sorted(
+                _rank_entry(summaries[tag], key_name, position)
+                for position, tag in enumerate(roster)
+            )
+            for name, key_name in LEADERBOARDS
+        },
+    }
+
+
+def load_execution_state(path: str):
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            state = json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if state.get("version") != EXECUTION_STATE_VERSION:
+        return {}
+    return state
+
+
+def save_execution_state(path: str, state) -> None:
+    write_json(path, state)
+
+
+def _last_event(path: str):
+    # Newest complete line of the stream, read backwards from the end.
+    try:
+        handle = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with handle:
+        position = handle.seek(0, os.SEEK_END)
+        tail = b""
+        while position > 0:
+            step = min(4096, position)
+            position -= step
+            handle.seek(position)
+            tail = handle.read(step) + tail
+            lines = tail.split(b"\n")
+            # Before reaching the start of the file the first piece may be cut.
+            for line in reversed(lines if position == 0 else lines[1:]):
+                try:
+                    return json.loads(line)
+                except ValueError:
+                    continue
+    return None
+
+
+def append_events(path: str, key: str, records) -> None:
+    # The state is saved after the append, so a crash in between (or a state
+    # file discarded on a version bump) replays attacks the stream already
+    # has. A war's events are appended in order, so the last line bounds them.
+    last = _last_event(path) if records else None
+    if last is not None and last.get("war") == key:
+        records = [record for record in records if record["order"] > last.get("order", 0)]
+    if not records:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as handle:
+        for record in records:
+            handle.write(json.dumps({"war": key, **record}, ensure_ascii=False) + "\n")
+
+
+@metrics.timed("update_execution")
+def update_execution(state, war_json):
+    # Attacks only append during a war, so everything up to state["lastOrder"]
+    # is already folded into the running totals. Returns the new attack records,
+    # or None when the payload has attacks without an order to key on.
+    clan_team = war_json.get("clan", {})
+    members = clan_team.get("members", [])
+    key = war_key(war_json)
+    roster = [member.get("tag") for member in members]
+    if state.get("warKey") != key or state.get("roster") != roster:
+        state.clear()
+        state.update(_empty_execution_state(key, members))
+
+    pending = []
+    for member in members:
+        for attack in member.get("attacks", []) or []:
+            order = attack.get("order")
+            if order is None:
+                return None
+            if order > state["lastOrder"]:
+                pending.append((order, member, attack))
+    if not pending:
+        return []
+
+    opponent_positions, opponent_names = _opponent_index(war_json.get("opponent", {}))
+    positions = {tag: position for position, tag in enumerate(roster)}
+    pending.sort(key=lambda item: item[0])
+    records = []
+    touched = set()
+    for order, member, attack in pending:
+        record = build_attack(member, attack, opponent_positions, opponent_names)
+        add_attack(state["players"][member.get("tag")], record)
+        records.append(record)
+        touched.add(member.get("tag"))
+        state["lastOrder"] = order
+    state["attacks"].extend(records)
+
+    for tag in touched:
+        previous = state["summaries"][tag]
+        summary = summarize_player(state["players"][tag])
+        state["summaries"][tag] = summary
+        for name, key_name in LEADERBOARDS:
+            ranking = state["rankings"][name]
+            ranking.remove(_rank_entry(previous, key_name, positions[tag]))
+            bisect.insort(ranking, _rank_entry(summary, key_name, positions[tag]))
+    return records
+
+
+def execution_from_state(state, limit=10):
+    players = [state["summaries"][tag] for tag in state["roster"]]
+    leaderboards = {
+        name: [state["summaries"][entry[2]] for entry in state["rankings"][name][:limit]]
+        for name, _ in LEADERBOARDS
+    }
+    return players, state["attacks"], leaderboards
+
+
+def export_execution(war_json, output_path: str, state=None):
+    # Writes the payload and, for active wars, folds only the attacks that are
+    # new since the persisted state into it. Returns the payload and the state
+    # for reuse.
+    active = bool(war_json) and war_json.get("state") not in (None, "notInWar")
+    state_path = execution_state_path(output_path)
+    if state is None:
+        state = load_execution_state(state_path) if active else {}
+    execution = None
+    if active:
+        records = update_execution(state, war_json)
+        if records is not None:
+            append_events(execution_events_path(output_path), state["warKey"], records)
+            execution = execution_from_state(state)
+    payload = build_execution_payload(war_json, execution)
+    write_output(output_path, payload)
+    if execution is not None:
+        save_execution_state(state_path, state)
+    return payload, state
+
+
+@metrics.timed("build_execution_payload")
+def build_execution_payload(war_json, execution=None):
+    state = war_json.get("state") if war_json else None
     players = []
     attacks = []
+    leaderboards = None
 
-    if war_json and state not in (None, "notInWar"):
+    if execution is not None:
+        players, attacks, leaderboards = execution
+    elif war_json and state not in (None, "notInWar"):
         clan_team = war_json.get("clan", {})
         opponent_team = war_json.get("opponent", {})
         players, attacks = build_execution(clan_team, opponent_team)
+    if leaderboards is None:
+        leaderboards = {name: build_leaderboard(players, key) for name, key in LEADERBOARDS}
 
-    payload = {
+    return {
         "meta": {
             "generatedAt": datetime.now(timezone.utc).isoformat(),
             "state": state or "unknown",
@@ -138,12 +325,7 @@ def main():
         },
         "players": players,
         "attacks": attacks,
-        "leaderboards": {
-            "mvp": build_leaderboard(players, "mvpScore"),
-            "stars": build_leaderboard(players, "totalStars"),
-            "destruction": build_leaderboard(players, "avgDestruction"),
-            "attacksUsed": build_leaderboard(players, "attacksUsed"),
-        },
+        "leaderboards": leaderboards,
         "scatter": [
             {
                 "tag": player.get("tag"),
@@ -156,9 +338,42 @@ def main():
         ],
     }
 
-    os.makedirs(os.path.dirname(args.output), exist_ok=True)
-    with open(args.output, "w", encoding="utf-8") as handle:
-        json.dump(payload, handle, ensure_ascii=False, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export war execution data")
+    parser.add_argument(
+        "--config",
+        default=os.path.join(os.path.dirname(__file__), "..", "config.example.json"),
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join(os.path.dirname(__file__), "..", "outputs", "war_execution.json"),
+    )
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    clan_tag = config.get("clanTag")
+    if not clan_tag:
+        raise RuntimeError("Config missing clanTag")
+
+    token = coc_api.read_token(config.get("tokenEnvVar", "COC_API_TOKEN"))
+    sleep_seconds = float(config.get("sleepSeconds", 0.25))
+    cache_ttl = int(config.get("cacheTtlSeconds", 3600))
+    cache_dir = os.path.join(os.path.dirname(__file__), "..", "cache")
+    coc_api.configure_from_config(config)
+    coc_api.reset_run_memo()
+    configure_output_from_config(config)
+
+    war_json = coc_api.get_current_war(clan_tag, token, sleep_seconds, cache_dir, cache_ttl)
+
+    if config.get("incrementalWarExecution", True):
+        export_execution(war_json, args.output)
+    else:
+        write_output(args.output, build_execution_payload(war_json))
+
+    coc_api.wait_for_refreshes()
+    prune_from_config(cache_dir, config)
+    write_run_metrics(config, os.path.dirname(args.output) or ".")
 
 
 if __name__ == "__main__":
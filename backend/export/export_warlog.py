@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+
+from .. import coc_api, metrics
+from ..cache import prune_from_config
+from ..history import HISTORY_PATH, HistoryStore
+from .output import configure_output_from_config, write_output, write_run_metrics
+
+DECIDED_RESULTS = ("win", "lose", "tie")
+
+
+def load_config(path: str):
+    with open(path, "r", encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def ingest_warlog(clan_tag, fetch_args, store, page_size=25, full=False):
+    # Pages come newest first. Once a full backfill has finished, a page made
+    # only of stored wars means everything older is stored too.
+    complete = store.warlog_complete(clan_tag) and not full
+    inserted = 0
+    after = None
+    while True:
+        page = coc_api.get_warlog_page(clan_tag, *fetch_args, limit=page_size, after=after)
+        if page is None:
+            return inserted
+        items = page.get("items", [])
+        added = store.record_wars(clan_tag, items)
+        inserted += added
+        after = ((page.get("paging") or {}).get("cursors") or {}).get("after")
+        if not items or not after:
+            store.mark_warlog_complete(clan_tag)
+            return inserted
+        if complete and added == 0:
+            return inserted
+
+
+def _ratio(numerator, denominator, digits=4):
+    return round(numerator / denominator, digits) if denominator else None
+
+
+def _window_stats(totals):
+    return {
+        "wars": totals["wars"],
+        "wins": totals["wins"],
+        "losses": totals["losses"],
+        "ties": totals["ties"],
+        "winRate": _ratio(totals["wins"], totals["decided"]),
+        "avgStars": _ratio(totals["stars"], totals["wars"], 2),
+        "avgDestruction": _ratio(totals["destruction"], totals["wars"], 2),
+    }
+
+
+def _empty_totals():
+    return {
+        "wars": 0,
+        "decided": 0,
+        "wins": 0,
+        "losses": 0,
+        "ties": 0,
+        "stars": 0,
+        "destruction": 0.0,
+    }
+
+
+def _apply(totals, war, sign):
+    result = war.get("result")
+    totals["wars"] += sign
+    totals["decided"] += sign if result in DECIDED_RESULTS else 0
+    totals["wins"] += sign if result == "win" else 0
+    totals["losses"] += sign if result == "lose" else 0
+    totals["ties"] += sign if result == "tie" else 0
+    totals["stars"] += sign * (war.get("stars") or 0)
+    totals["destruction"] += sign * (war.get("destruction") or 0)
+
+
+@metrics.timed("build_warlog_series")
+def build_warlog_series(wars, window=10):
+    # wars are oldest first; the rolling window is maintained with running sums.
+    totals = _empty_totals()
+    rolling = _empty_totals()
+    series = []
+    for index, war in enumerate(wars):
+        _apply(totals, war, 1)
+        _apply(rolling, war, 1)
+        if index >= window:
+            _apply(rolling, wars[index - window], -1)
+        series.append(
+            {
+                **war,
+                "starDiff": (war.get("stars") or 0) - (war.get("opponentStars") or 0),
+                "rolling": _window_stats(rolling),
+            }
+        )
+    return series, _window_stats(totals)
+
+
+def build_warlog_payload(clan_tag, wars, window=10):
+    series, summary = build_warlog_series(wars, window)
+    return {
+        "meta": {
+            "generatedAt": datetime.now(timezone.utc).isoformat(),
+            "clanTag": clan_tag,
+            "window": window,
+        },
+        "summary": summary,
+        "wars": series,
+    }
+
+
+def export_warlog(clan_tag, fetch_args, config, output_path, full=False):
+    store = HistoryStore(config.get("historyPath") or HISTORY_PATH)
+    try:
+        page_size = int(config.get("warlogPageSize", 25))
+        inserted = ingest_warlog(clan_tag, fetch_args, store, page_size, full)
+        payload = build_warlog_payload(
+            clan_tag, store.wars(clan_tag), int(config.get("warlogWindow", 10))
+        )
+    finally:
+        store.close()
+    write_output(output_path, payload)
+    return inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the war log and export war series")
+    parser.add_argument(
+        "--config",
+        default=os.path.join(os.path.dirname(__file__), "..", "config.example.json"),
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join(os.path.dirname(__file__), "..", "outputs", "warlog_stats.json"),
+    )
+    parser.add_argument("--full", action="store_true", help="Walk every page again")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    clan_tag = config.get("clanTag")
+    if not clan_tag:
+        raise RuntimeError("Config missing clanTag")
+
+    token = coc_api.read_token(config.get("tokenEnvVar", "COC_API_TOKEN"))
+    sleep_seconds = float(config.get("sleepSeconds", 0.25))
+    cache_ttl = int(config.get("cacheTtlSeconds", 3600))
+    cache_dir = os.path.join(os.path.dirname(__file__), "..", "cache")
+    coc_api.configure_from_config(config)
+    coc_api.reset_run_memo()
+    configure_output_from_config(config)
+
+    fetch_args = (token, sleep_seconds, cache_dir, cache_ttl)
+    inserted = export_warlog(clan_tag, fetch_args, config, args.output, args.full)
+    print(f"Guerras nuevas en el historial: {inserted}")
+
+    coc_api.wait_for_refreshes()
+    prune_from_config(cache_dir, config)
+    write_run_metrics(config, os.path.dirname(args.output) or ".")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import gzip
+import json
+import os
+import tempfile
+
+from .. import metrics
+
+METRICS_FILE = "metrics.json"
+PROMETHEUS_FILE = "metrics.prom"
+
+_minify = True
+_precompress = False
+
+
+def configure_output(minify: bool = True, precompress: bool = False) -> None:
+    global _minify, _precompress
+    _minify = minify
+    _precompress = precompress
+
+
+def configure_output_from_config(config) -> None:
+    configure_output(
+        bool(config.get("minifyOutputs", True)), bool(config.get("gzipOutputs", False))
+    )
+
+
+def _encode(payload) -> bytes:
+    if _minify:
+        text = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    else:
+        text = json.dumps(payload, ensure_ascii=False, indent=2)
+    return text.encode("utf-8")
+
+
+def _replace(path: str, data: bytes) -> None:
+    # Readers (the dashboard, watch mode) never see a half-written file.
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(data)
+        # mkstemp creates 0600 files; outputs are served to the dashboard.
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+        metrics.inc("output_bytes_written_total", len(data))
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_json(path: str, payload) -> None:
+    _replace(path, _encode(payload))
+
+
+def write_text(path: str, text: str) -> None:
+    _replace(path, text.encode("utf-8"))
+
+
+def write_output(path: str, payload) -> bool:
+    # Dashboard files: identical bytes are left alone so their mtime (and any
+    # HTTP validators derived from it) only move when the content does.
+    data = _encode(payload)
+    gz_path = f"{path}.gz"
+    try:
+        with open(path, "rb") as handle:
+            unchanged = handle.read() == data
+    except FileNotFoundError:
+        unchanged = False
+    if unchanged and _precompress == os.path.exists(gz_path):
+        metrics.inc("outputs_unchanged_total")
+        return False
+    _replace(path, data)
+    if _precompress:
+        _replace(gz_path, gzip.compress(data, mtime=0))
+    else:
+        _remove(gz_path)
+    return True
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_output(path: str) -> None:
+    _remove(path)
+    _remove(f"{path}.gz")
+
+
+def write_run_metrics(config, output_dir: str):
+    # Written after every run (pipeline, batch, watch cycle or a standalone
+    # exporter), next to the outputs it describes.
+    if not config.get("writeMetrics", True):
+        return []
+    data = metrics.snapshot()
+    paths = [os.path.join(output_dir, METRICS_FILE)]
+    write_json(paths[0], data)
+    if config.get("metricsPrometheus"):
+        paths.append(os.path.join(output_dir, PROMETHEUS_FILE))
+        write_text(paths[1], metrics.to_prometheus(data))
+    return paths
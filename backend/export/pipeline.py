@@ -0,0 +1,358 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .. import coc_api, metrics
+from ..cache import prune_from_config
+from ..history import history_from_config
+from ..normalize import profile_source_hash
+from .export_active_war import assemble_team, build_war_payload, write_war_payload
+from .export_clan_snapshot import (
+    build_profile,
+    build_snapshot,
+    load_snapshot_state,
+    save_snapshot_state,
+    snapshot_state_path,
+    update_snapshot,
+    write_snapshot,
+)
+from .export_warlog import export_warlog
+from .export_war_execution import build_execution_payload, export_execution, war_key
+from .output import configure_output_from_config, write_output, write_run_metrics
+
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "..", "outputs")
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", "cache")
+
+
+def load_config(path: str):
+    with open(path, "r", encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def _war_is_active(war_json) -> bool:
+    return bool(war_json) and war_json.get("state") not in (None, "notInWar")
+
+
+def _war_tags(war_json):
+    if not _war_is_active(war_json):
+        return []
+    return [
+        member.get("tag")
+        for side in ("clan", "opponent")
+        for member in (war_json.get(side) or {}).get("members", [])
+    ]
+
+
+def _fetch_clan_sources(clan_tag, config, fetch_args, executor):
+    clan_future = executor.submit(coc_api.get_clan, clan_tag, *fetch_args)
+    members_future = executor.submit(coc_api.get_members, clan_tag, *fetch_args)
+    war_future = executor.submit(coc_api.get_current_war, clan_tag, *fetch_args)
+    warlog_future = None
+    if config.get("includeWarlog"):
+        warlog_future = executor.submit(coc_api.get_warlog, clan_tag, *fetch_args)
+
+    def collect():
+        # A failing currentwar (e.g. private war log) must not block the clan
+        # snapshot; export_clan re-raises it once the snapshot is on disk.
+        war_json, war_error = None, None
+        try:
+            war_json = war_future.result()
+        except RuntimeError as error:
+            war_error = error
+        return {
+            "clanTag": clan_tag,
+            "clan": clan_future.result(),
+            "members": members_future.result(),
+            "warlog": warlog_future.result() if warlog_future else None,
+            "war": war_json,
+            "warError": war_error,
+        }
+
+    return collect
+
+
+def source_tags(sources):
+    member_tags = [member.get("tag") for member in sources["members"]]
+    return list(dict.fromkeys(member_tags + _war_tags(sources["war"])))
+
+
+def _digest(*inputs) -> str:
+    encoded = json.dumps(inputs, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def _warm_profile(tag, player_json, warm):
+    if warm is None:
+        return build_profile(player_json)
+    source_hash = profile_source_hash(player_json)
+    cached = warm.setdefault("profiles", {}).get(tag)
+    if cached is None or cached[0] != source_hash:
+        cached = (source_hash, build_profile(player_json))
+        warm["profiles"][tag] = cached
+    return cached[1]
+
+
+def export_clan(sources, player_jsons, config, output_dir: str, warm=None):
+    # `warm` is an optional dict that long-running callers (watch mode) pass on
+    # every call: it keeps the snapshot state and built profiles in memory, and
+    # outputs whose inputs did not change since the previous call are skipped.
+    clan_tag = sources["clanTag"]
+    clan = sources["clan"]
+    warlog = sources["warlog"]
+    war_json = sources["war"]
+    member_tags = [member.get("tag") for member in sources["members"]]
+    digests = warm.setdefault("digests", {}) if warm is not None else None
+
+    def changed(name, inputs):
+        # inputs is a callable so one-shot runs never pay for hashing.
+        if digests is None:
+            return True, None
+        digest = _digest(*inputs())
+        return digests.get(name) != digest, digest
+
+    snapshot_path = os.path.join(output_dir, "clan_snapshot.json")
+    state_path = snapshot_state_path(snapshot_path)
+    aggregates = None
+    if config.get("incrementalSnapshot", True):
+        state = warm.get("snapshotState") if warm is not None else None
+        if state is None:
+            state = load_snapshot_state(state_path, clan_tag)
+        profiles, aggregates, _ = update_snapshot(
+            state, member_tags, [player_jsons[tag] for tag in member_tags]
+        )
+        if warm is not None:
+            warm["snapshotState"] = state
+    else:
+        profiles = [_warm_profile(tag, player_jsons[tag], warm) for tag in member_tags]
+    profiles_by_tag = dict(zip(member_tags, profiles))
+
+    @metrics.timed("export_clan_snapshot")
+    def snapshot_stage():
+        write, digest = changed(
+            "clan_snapshot",
+            lambda: (
+                clan,
+                warlog,
+                [profile_source_hash(player_jsons[tag]) for tag in member_tags],
+            ),
+        )
+        if not write:
+            return []
+        snapshot = build_snapshot(clan_tag, clan, profiles, warlog, aggregates)
+        written = write_snapshot(snapshot_path, snapshot, config)
+        if history is not None:
+            history.record_snapshot(snapshot)
+        if aggregates is not None:
+            save_snapshot_state(state_path, state)
+        if digest:
+            digests["clan_snapshot"] = digest
+        return written
+
+    @metrics.timed("export_war_active")
+    def war_active_stage():
+        war_state = war_json.get("state") if war_json else None
+        tags = _war_tags(war_json)
+        write, digest = changed(
+            "war_active",
+            lambda: (war_json, [profile_source_hash(player_jsons[tag]) for tag in tags]),
+        )
+        if not write:
+            return []
+        teams = []
+        if _war_is_active(war_json):
+            team_profiles = {
+                tag: profiles_by_tag.get(tag) or _warm_profile(tag, player_jsons[tag], warm)
+                for tag in tags
+            }
+            teams = [
+                assemble_team(war_json.get("clan", {}), "clan", team_profiles),
+                assemble_team(war_json.get("opponent", {}), "opponent", team_profiles),
+            ]
+        path = os.path.join(output_dir, "war_active.json")
+        written = write_war_payload(path, build_war_payload(war_state, teams), config)
+        if digest:
+            digests["war_active"] = digest
+        return written
+
+    @metrics.timed("export_war_execution")
+    def war_execution_stage():
+        write, digest = changed("war_execution", lambda: (war_json,))
+        if not write:
+            return None
+        path = os.path.join(output_dir, "war_execution.json")
+        if config.get("incrementalWarExecution", True):
+            state = warm.get("executionState") if warm is not None else None
+            payload, state = export_execution(war_json, path, state)
+            if warm is not None:
+                warm["executionState"] = state
+        else:
+            payload = build_execution_payload(war_json)
+            write_output(path, payload)
+        if history is not None and _war_is_active(war_json):
+            history.record_war(war_key(war_json), clan_tag, payload)
+        if digest:
+            digests["war_execution"] = digest
+        return path
+
+    configure_output_from_config(config)
+    history = history_from_config(config)
+    try:
+        outputs = snapshot_stage()
+        if sources["warError"] is not None:
+            raise sources["warError"]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            war_active = executor.submit(war_active_stage)
+            war_execution = executor.submit(war_execution_stage)
+            outputs.extend(war_active.result())
+            outputs.append(war_execution.result())
+    finally:
+        if history is not None:
+            history.close()
+    return [path for path in outputs if path]
+
+
+def fetch_settings(config, cache_dir):
+    token = coc_api.read_token(config.get("tokenEnvVar", "COC_API_TOKEN"))
+    sleep_seconds = float(config.get("sleepSeconds", 0.25))
+    cache_ttl = int(config.get("cacheTtlSeconds", 3600))
+    coc_api.configure_from_config(config)
+    coc_api.reset_run_memo()
+    metrics.reset()
+    return (token, sleep_seconds, cache_dir, cache_ttl), int(config.get("maxWorkers", 8))
+
+
+def run_pipeline(config, output_dir: str = OUTPUT_DIR, cache_dir: str = CACHE_DIR):
+    clan_tag = config.get("clanTag")
+    if not clan_tag:
+        raise RuntimeError("Config missing clanTag")
+
+    fetch_args, max_workers = fetch_settings(config, cache_dir)
+    with metrics.stage("fetch_sources"), ThreadPoolExecutor(max_workers=4) as executor:
+        sources = _fetch_clan_sources(clan_tag, config, fetch_args, executor)()
+
+    unique_tags = source_tags(sources)
+    with metrics.stage("fetch_players"):
+        player_jsons = dict(
+            zip(unique_tags, coc_api.get_players(unique_tags, *fetch_args, max_workers))
+        )
+    try:
+        outputs = export_clan(sources, player_jsons, config, output_dir)
+        if config.get("warlogBackfill"):
+            warlog_path = os.path.join(output_dir, "warlog_stats.json")
+            with metrics.stage("export_warlog"):
+                export_warlog(clan_tag, fetch_args, config, warlog_path)
+            outputs.append(warlog_path)
+        return outputs
+    finally:
+        with metrics.stage("finish"):
+            coc_api.wait_for_refreshes()
+            prune_from_config(cache_dir, config)
+        write_run_metrics(config, output_dir)
+
+
+def clan_output_dir(output_dir: str, clan_tag: str) -> str:
+    return os.path.join(output_dir, clan_tag.replace("#", ""))
+
+
+def _export_clan_job(sources, player_jsons, config, output_dir):
+    # Workers report their own metrics; run_batch folds them into the run total.
+    metrics.reset()
+    try:
+        return export_clan(sources, player_jsons, config, output_dir), None, metrics.snapshot()
+    except Exception as error:
+        # One clan's disk or SQLite failure must not abort the other clans.
+        return None, f"{type(error).__name__}: {error}", metrics.snapshot()
+
+
+def run_batch(config, output_dir: str = OUTPUT_DIR, cache_dir: str = CACHE_DIR):
+    clan_tags = list(dict.fromkeys(config.get("clanTags") or []))
+    if not clan_tags:
+        raise RuntimeError("Config missing clanTags")
+
+    fetch_args, max_workers = fetch_settings(config, cache_dir)
+    with metrics.stage("fetch_sources"), ThreadPoolExecutor(
+        max_workers=max(4, max_workers)
+    ) as executor:
+        collectors = [
+            _fetch_clan_sources(clan_tag, config, fetch_args, executor) for clan_tag in clan_tags
+        ]
+        all_sources = [collect() for collect in collectors]
+
+    # One deduplicated fetch for every player across all clans and their wars.
+    unique_tags = list(
+        dict.fromkeys(tag for sources in all_sources for tag in source_tags(sources))
+    )
+    with metrics.stage("fetch_players"):
+        player_jsons = dict(
+            zip(unique_tags, coc_api.get_players(unique_tags, *fetch_args, max_workers))
+        )
+
+    results = {}
+    processes = int(config.get("batchProcesses", os.cpu_count() or 1))
+    # spawn, not fork: this process still has live threads (refresh workers,
+    # the HTTP pool, SQLite) whose locks a forked child could inherit held.
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(processes, len(clan_tags))),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        jobs = {}
+        for sources in all_sources:
+            tags = source_tags(sources)
+            # Exceptions do not pickle reliably; the worker re-raises a plain one.
+            job_sources = {**sources, "warError": None}
+            if sources["warError"] is not None:
+                job_sources["warError"] = RuntimeError(str(sources["warError"]))
+            jobs[sources["clanTag"]] = executor.submit(
+                _export_clan_job,
+                job_sources,
+                {tag: player_jsons[tag] for tag in tags},
+                config,
+                clan_output_dir(output_dir, sources["clanTag"]),
+            )
+        for clan_tag, job in jobs.items():
+            outputs, error, job_metrics = job.result()
+            metrics.merge(job_metrics)
+            results[clan_tag] = {"outputs": outputs, "error": error}
+
+    if config.get("warlogBackfill"):
+        # Paging shares the rate limiter and memo, so it stays in this process.
+        for clan_tag, result in results.items():
+            if result["outputs"] is None:
+                continue
+            warlog_path = os.path.join(clan_output_dir(output_dir, clan_tag), "warlog_stats.json")
+            with metrics.stage("export_warlog"):
+                export_warlog(clan_tag, fetch_args, config, warlog_path)
+            result["outputs"].append(warlog_path)
+
+    with metrics.stage("finish"):
+        coc_api.wait_for_refreshes()
+        prune_from_config(cache_dir, config)
+    write_run_metrics(config, output_dir)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export all dashboard data in one pass")
+    parser.add_argument(
+        "--config",
+        default=os.path.join(os.path.dirname(__file__), "..", "config.example.json"),
+    )
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if config.get("clanTags"):
+        for clan_tag, result in run_batch(config, args.output_dir).items():
+            if result["error"]:
+                print(f"{clan_tag}: error en la exportación ({result['error']})")
+            else:
+                print(f"{clan_tag}: {len(result['outputs'])} archivos exportados")
+    else:
+        run_pipeline(config, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import time
+
+from .. import coc_api, metrics
+from ..cache import prune_from_config
+from .pipeline import (
+    CACHE_DIR,
+    OUTPUT_DIR,
+    export_clan,
+    fetch_settings,
+    source_tags,
+    write_run_metrics,
+)
+
+ACTIVE_WAR_STATES = ("preparation", "inWar")
+
+
+def load_config(path: str):
+    with open(path, "r", encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def run_watch(config, output_dir: str = OUTPUT_DIR, cache_dir: str = CACHE_DIR, cycles=None):
+    clan_tag = config.get("clanTag")
+    if not clan_tag:
+        raise RuntimeError("Config missing clanTag")
+
+    fetch_args, max_workers = fetch_settings(config, cache_dir)
+    token, sleep_seconds, _, cache_ttl = fetch_args
+    war_seconds = float(config.get("watchWarSeconds", 60))
+    idle_seconds = float(config.get("watchIdleSeconds", 600))
+    roster_seconds = float(config.get("watchRosterSeconds", cache_ttl))
+    roster_args = (token, sleep_seconds, cache_dir, int(min(cache_ttl, roster_seconds)))
+    war_args = (token, sleep_seconds, cache_dir, war_seconds)
+
+    # Everything below lives for the whole process: profiles, snapshot state and
+    # output digests stay warm between cycles instead of being rebuilt per run.
+    warm = {}
+    player_jsons = {}
+    roster = None
+    last_roster_refresh = None
+    cycle = 0
+    while cycles is None or cycle < cycles:
+        cycle += 1
+        started = time.monotonic()
+        coc_api.reset_run_memo()
+        metrics.reset()
+        delay = idle_seconds
+        refresh_roster = (
+            last_roster_refresh is None or started - last_roster_refresh >= roster_seconds
+        )
+        try:
+            if refresh_roster:
+                roster = {
+                    "clan": coc_api.get_clan(clan_tag, *roster_args),
+                    "members": coc_api.get_members(clan_tag, *roster_args),
+                    "warlog": (
+                        coc_api.get_warlog(clan_tag, *roster_args)
+                        if config.get("includeWarlog")
+                        else None
+                    ),
+                }
+            war_json, war_error = None, None
+            try:
+                # The poll interval sets the refresh rate: revalidate every cycle
+                # (a 304 when nothing changed) rather than let the server's
+                # max-age skip polls during a war.
+                war_json = coc_api.get_current_war(clan_tag, *war_args, revalidate=True)
+            except RuntimeError as error:
+                war_error = error
+            if war_json and war_json.get("state") in ACTIVE_WAR_STATES:
+                delay = war_seconds
+
+            sources = {"clanTag": clan_tag, **roster, "war": war_json, "warError": war_error}
+            tags = source_tags(sources)
+            # Between roster refreshes only players new to this cycle are fetched.
+            pending = tags if refresh_roster else [tag for tag in tags if tag not in player_jsons]
+            with metrics.stage("fetch_players"):
+                fetched = coc_api.get_players(pending, *roster_args, max_workers)
+            player_jsons.update(zip(pending, fetched))
+            player_jsons = {tag: player_jsons[tag] for tag in tags}
+            if refresh_roster:
+                last_roster_refresh = started
+
+            written = export_clan(sources, player_jsons, config, output_dir, warm)
+            if written:
+                names = ", ".join(os.path.basename(path) for path in written)
+                print(f"[{time.strftime('%H:%M:%S')}] Actualizado: {names}")
+            if refresh_roster:
+                prune_from_config(cache_dir, config)
+        except Exception as error:
+            # Bad payloads, disk or SQLite errors must not end the daemon either;
+            # only KeyboardInterrupt (not an Exception) stops the loop.
+            print(f"[{time.strftime('%H:%M:%S')}] Ciclo fallido: {error!r}")
+            delay = min(war_seconds, idle_seconds)
+        try:
+            write_run_metrics(config, output_dir)
+        except OSError as error:
+            print(f"[{time.strftime('%H:%M:%S')}] Métricas no escritas: {error}")
+
+        if cycles is not None and cycle >= cycles:
+            break
+        time.sleep(max(0.0, delay - (time.monotonic() - started)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep dashboard exports continuously fresh")
+    parser.add_argument(
+        "--config",
+        default=os.path.join(os.path.dirname(__file__), "..", "config.example.json"),
+    )
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    try:
+        run_watch(load_config(args.config), args.output_dir)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+HISTORY_PATH = os.path.join(os.path.dirname(__file__), "history", "history.sqlite3")
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS snapshots ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, clan_tag TEXT NOT NULL, "
+    "recorded_at REAL NOT NULL, members INTEGER NOT NULL, th_avg REAL)",
+    "CREATE INDEX IF NOT EXISTS snapshots_clan_time ON snapshots (clan_tag, recorded_at)",
+    "CREATE TABLE IF NOT EXISTS player_points ("
+    "snapshot_id INTEGER NOT NULL, player_tag TEXT NOT NULL, recorded_at REAL NOT NULL, "
+    "th INTEGER, exp_level INTEGER, power_index TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS player_points_tag_time ON player_points (player_tag, recorded_at)",
+    "CREATE TABLE IF NOT EXISTS coverage_points ("
+    "snapshot_id INTEGER NOT NULL, clan_tag TEXT NOT NULL, recorded_at REAL NOT NULL, "
+    "category TEXT NOT NULL, unit TEXT NOT NULL, coverage90 INTEGER, "
+    "coverage_rate REAL, avg_pct REAL)",
+    "CREATE INDEX IF NOT EXISTS coverage_points_clan_time "
+    "ON coverage_points (clan_tag, category, recorded_at)",
+    "CREATE INDEX IF NOT EXISTS coverage_points_unit_time "
+    "ON coverage_points (clan_tag, category, unit, recorded_at)",
+    "CREATE TABLE IF NOT EXISTS war_results ("
+    "war_key TEXT NOT NULL, player_tag TEXT NOT NULL, clan_tag TEXT NOT NULL, "
+    "recorded_at REAL NOT NULL, state TEXT, attacks_used INTEGER, total_stars INTEGER, "
+    "avg_destruction REAL, avg_delta REAL, mvp_score REAL, "
+    "PRIMARY KEY (war_key, player_tag))",
+    "CREATE INDEX IF NOT EXISTS war_results_tag_time ON war_results (player_tag, recorded_at)",
+    "CREATE INDEX IF NOT EXISTS war_results_clan_time ON war_results (clan_tag, recorded_at)",
+    "CREATE TABLE IF NOT EXISTS wars ("
+    "clan_tag TEXT NOT NULL, end_time TEXT NOT NULL, ended_at REAL, result TEXT, "
+    "team_size INTEGER, attacks_per_member INTEGER, opponent_tag TEXT, opponent_name TEXT, "
+    "stars INTEGER, destruction REAL, attacks INTEGER, exp_earned INTEGER, "
+    "opponent_stars INTEGER, opponent_destruction REAL, PRIMARY KEY (clan_tag, end_time))",
+    "CREATE INDEX IF NOT EXISTS wars_clan_time ON wars (clan_tag, ended_at)",
+    "CREATE TABLE IF NOT EXISTS warlog_sync ("
+    "clan_tag TEXT PRIMARY KEY, complete INTEGER NOT NULL DEFAULT 0)",
+)
+_WAR_COLUMNS = (
+    "endTime",
+    "endedAt",
+    "result",
+    "teamSize",
+    "attacksPerMember",
+    "opponentTag",
+    "opponentName",
+    "stars",
+    "destruction",
+    "attacks",
+    "expEarned",
+    "opponentStars",
+    "opponentDestruction",
+)
+
+
+def _timestamp(value) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def api_timestamp(value: Optional[str]) -> Optional[float]:
+    # The API encodes times as 20240101T120000.000Z.
+    if not value:
+        return None
+    parsed = datetime.strptime(value, "%Y%m%dT%H%M%S.%fZ")
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def _range_clause(column: str, since, until):
+    clauses, params = [], []
+    if since is not None:
+        clauses.append(f"{column} >= ?")
+        params.append(_timestamp(since))
+    if until is not None:
+        clauses.append(f"{column} <= ?")
+        params.append(_timestamp(until))
+    return "".join(f" AND {clause}" for clause in clauses), params
+
+
+class HistoryStore:
+    # Snapshots are append-only; war rows are keyed by war and player so
+    # re-exports during a war keep only its latest (and finally its end) result.
+    def __init__(self, path: str = HISTORY_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # Batch mode records from several processes; wait on their write locks.
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def record_snapshot(self, snapshot, recorded_at=None) -> int:
+        recorded = _timestamp(recorded_at or snapshot.get("meta", {}).get("generatedAt"))
+        clan_tag = snapshot.get("meta", {}).get("clanTag")
+        members = snapshot.get("members", [])
+        aggregates = snapshot.get("aggregates", {})
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO snapshots (clan_tag, recorded_at, members, th_avg) VALUES (?, ?, ?, ?)",
+                (clan_tag, recorded, len(members), aggregates.get("thAvg")),
+            )
+            snapshot_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO player_points VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        snapshot_id,
+                        member.get("tag"),
+                        recorded,
+                        member.get("th"),
+                        member.get("expLevel"),
+                        json.dumps(member.get("derived", {}).get("powerIndex", {})),
+                    )
+                    for member in members
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO coverage_points VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        snapshot_id,
+                        clan_tag,
+                        recorded,
+                        category,
+                        row.get("unit"),
+                        row.get("coverage90"),
+                        row.get("coverageRate"),
+                        row.get("avgPct"),
+                    )
+                    for category, rows in aggregates.get("coverage", {}).items()
+                    for row in rows
+                ],
+            )
+        return snapshot_id
+
+    def record_war(self, war_key: str, clan_tag: str, execution, recorded_at=None) -> None:
+        meta = execution.get("meta", {})
+        recorded = _timestamp(recorded_at or meta.get("generatedAt"))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO war_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        war_key,
+                        player.get("tag"),
+                        clan_tag,
+                        recorded,
+                        meta.get("state"),
+                        player.get("attacksUsed"),
+                        player.get("totalStars"),
+                        player.get("avgDestruction"),
+                        player.get("avgDelta"),
+                        player.get("mvpScore"),
+                    )
+                    for player in execution.get("players", [])
+                ],
+            )
+
+    def record_wars(self, clan_tag: str, items) -> int:
+        # War log entries are immutable once a war ends, so known wars are skipped.
+        rows = []
+        for item in items:
+            clan = item.get("clan") or {}
+            opponent = item.get("opponent") or {}
+            rows.append(
+                (
+                    clan_tag,
+                    item.get("endTime"),
+                    api_timestamp(item.get("endTime")),
+                    item.get("result"),
+                    item.get("teamSize"),
+                    item.get("attacksPerMember"),
+                    opponent.get("tag"),
+                    opponent.get("name"),
+                    clan.get("stars"),
+                    clan.get("destructionPercentage"),
+                    clan.get("attacks"),
+                    clan.get("expEarned"),
+                    opponent.get("stars"),
+                    opponent.get("destructionPercentage"),
+                )
+            )
+        with self._lock, self._conn:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO wars VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [row for row in rows if row[1]],
+            )
+        return max(cursor.rowcount, 0)
+
+    def warlog_complete(self, clan_tag: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT complete FROM warlog_sync WHERE clan_tag = ?", (clan_tag,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def mark_warlog_complete(self, clan_tag: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO warlog_sync (clan_tag, complete) VALUES (?, 1)",
+                (clan_tag,),
+            )
+
+    def wars(self, clan_tag: str, since=None, until=None) -> List[Dict]:
+        clause, params = _range_clause("ended_at", since, until)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT end_time, ended_at, result, team_size, attacks_per_member, opponent_tag, "
+                "opponent_name, stars, destruction, attacks, exp_earned, opponent_stars, "
+                f"opponent_destruction FROM wars WHERE clan_tag = ?{clause} ORDER BY ended_at",
+                [clan_tag, *params],
+            ).fetchall()
+        wars = []
+        for row in rows:
+            war = dict(zip(_WAR_COLUMNS, row))
+            war["endedAt"] = _isoformat(row[1]) if row[1] is not None else None
+            wars.append(war)
+        return wars
+
+    def power_progression(self, player_tag: str, since=None, until=None) -> List[Dict]:
+        clause, params = _range_clause("recorded_at", since, until)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT recorded_at, th, exp_level, power_index FROM player_points "
+                f"WHERE player_tag = ?{clause} ORDER BY recorded_at",
+                [player_tag, *params],
+            ).fetchall()
+        return [
+            {
+                "recordedAt": _isoformat(row[0]),
+                "th": row[1],
+                "expLevel": row[2],
+                "powerIndex": json.loads(row[3]),
+            }
+            for row in rows
+        ]
+
+    def coverage_trend(
+        self, clan_tag: str, category: str, unit: Optional[str] = None, since=None, until=None
+    ) -> List[Dict]:
+        # Per unit when one is given, otherwise the clan-wide mean per snapshot.
+        clause, params = _range_clause("recorded_at", since, until)
+        with self._lock:
+            if unit is not None:
+                rows = self._conn.execute(
+                    "SELECT recorded_at, coverage90, coverage_rate, avg_pct FROM coverage_points "
+                    f"WHERE clan_tag = ? AND category = ? AND unit = ?{clause} "
+                    "ORDER BY recorded_at",
+                    [clan_tag, category, unit, *params],
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT recorded_at, SUM(coverage90), AVG(coverage_rate), AVG(avg_pct) "
+                    "FROM coverage_points "
+                    f"WHERE clan_tag = ? AND category = ?{clause} "
+                    "GROUP BY snapshot_id ORDER BY recorded_at",
+                    [clan_tag, category, *params],
+                ).fetchall()
+        return [
+            {
+                "recordedAt": _isoformat(row[0]),
+                "coverage90": row[1],
+                "coverageRate": round(row[2], 4) if row[2] is not None else None,
+                "avgPct": round(row[3], 4) if row[3] is not None else None,
+            }
+            for row in rows
+        ]
+
+    def war_performance(
+        self,
+        player_tag: Optional[str] = None,
+        clan_tag: Optional[str] = None,
+        since=None,
+        until=None,
+    ) -> List[Dict]:
+        if player_tag is None and clan_tag is None:
+            raise RuntimeError("war_performance needs player_tag or clan_tag")
+        clause, params = _range_clause("recorded_at", since, until)
+        column, value = ("player_tag", player_tag) if player_tag else ("clan_tag", clan_tag)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT war_key, player_tag, recorded_at, state, attacks_used, total_stars, "
+                "avg_destruction, avg_delta, mvp_score FROM war_results "
+                f"WHERE {column} = ?{clause} ORDER BY recorded_at, war_key",
+                [value, *params],
+            ).fetchall()
+        return [
+            {
+                "warKey": row[0],
+                "tag": row[1],
+                "recordedAt": _isoformat(row[2]),
+                "state": row[3],
+                "attacksUsed": row[4],
+                "totalStars": row[5],
+                "avgDestruction": row[6],
+                "avgDelta": row[7],
+                "mvpScore": row[8],
+            }
+            for row in rows
+        ]
+
+
+def history_from_config(config) -> Optional[HistoryStore]:
+    if not config.get("recordHistory"):
+        return None
+    return HistoryStore(config.get("historyPath") or HISTORY_PATH)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the snapshot history")
+    parser.add_argument("query", choices=["power", "coverage", "war"])
+    parser.add_argument("tag", help="Player tag (power, war) or clan tag (coverage, war --clan)")
+    parser.add_argument("--path", default=HISTORY_PATH)
+    parser.add_argument("--category", default="troops")
+    parser.add_argument("--unit")
+    parser.add_argument("--clan", action="store_true", help="Treat tag as a clan tag for war")
+    parser.add_argument("--since")
+    parser.add_argument("--until")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.path)
+    try:
+        if args.query == "power":
+            rows = store.power_progression(args.tag, args.since, args.until)
+        elif args.query == "coverage":
+            rows = store.coverage_trend(args.tag, args.category, args.unit, args.since, args.until)
+        elif args.clan:
+            rows = store.war_performance(clan_tag=args.tag, since=args.since, until=args.until)
+        else:
+            rows = store.war_performance(args.tag, since=args.since, until=args.until)
+    finally:
+        store.close()
+    print(json.dumps(rows, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Dict, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_PREFIX = "coc_"
+
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[_LabelKey, float]] = {}
+_histograms: Dict[str, Dict[_LabelKey, Dict]] = {}
+_stages: Dict[str, Dict[str, float]] = {}
+_started_at = datetime.now(timezone.utc).isoformat()
+
+
+def _label_key(labels) -> _LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def reset() -> None:
+    global _started_at
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _stages.clear()
+        _started_at = datetime.now(timezone.utc).isoformat()
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    key = _label_key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    key = _label_key(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = {"counts": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0}
+            series[key] = histogram
+        index = len(LATENCY_BUCKETS)
+        for position, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                index = position
+                break
+        histogram["counts"][index] += 1
+        histogram["sum"] += seconds
+
+
+def add_stage(name: str, seconds: float, calls: int = 1) -> None:
+    with _lock:
+        stage_totals = _stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+        stage_totals["seconds"] += seconds
+        stage_totals["calls"] += calls
+
+
+@contextmanager
+def stage(name: str):
+    # Stages run inside thread pools add up, so a stage can exceed wall time.
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add_stage(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def snapshot() -> Dict:
+    # Histogram buckets are cumulative, as in the Prometheus exposition format.
+    bounds = [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+    with _lock:
+        counters = {
+            name: [{"labels": dict(key), "value": value} for key, value in sorted(series.items())]
+            for name, series in sorted(_counters.items())
+        }
+        histograms = {}
+        for name, series in sorted(_histograms.items()):
+            rows = []
+            for key, histogram in sorted(series.items()):
+                total = 0
+                buckets = []
+                for bound, count in zip(bounds, histogram["counts"]):
+                    total += count
+                    buckets.append([bound, total])
+                rows.append(
+                    {
+                        "labels": dict(key),
+                        "buckets": buckets,
+                        "sum": round(histogram["sum"], 6),
+                        "count": total,
+                    }
+                )
+            histograms[name] = rows
+        stages = {
+            name: {"seconds": round(totals["seconds"], 6), "calls": int(totals["calls"])}
+            for name, totals in sorted(_stages.items())
+        }
+        started_at = _started_at
+    return {
+        "meta": {
+            "startedAt": started_at,
+            "generatedAt": datetime.now(timezone.utc).isoformat(),
+        },
+        "counters": counters,
+        "histograms": histograms,
+        "stages": stages,
+    }
+
+
+def merge(other: Dict) -> None:
+    # Folds a snapshot taken in another process (run_batch workers) into this one.
+    for name, rows in other.get("counters", {}).items():
+        for row in rows:
+            inc(name, row["value"], **row["labels"])
+    for name, rows in other.get("histograms", {}).items():
+        for row in rows:
+            key = _label_key(row["labels"])
+            with _lock:
+                series = _histograms.setdefault(name, {})
+                histogram = series.setdefault(
+                    key, {"counts": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0}
+                )
+                previous = 0
+                for index, (_, cumulative) in enumerate(row["buckets"]):
+                    histogram["counts"][index] += cumulative - previous
+                    previous = cumulative
+                histogram["sum"] += row["sum"]
+    for name, totals in other.get("stages", {}).items():
+        add_stage(name, totals["seconds"], totals["calls"])
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=None) -> str:
+    pairs = list(labels.items()) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def to_prometheus(data: Dict = None) -> str:
+    data = data if data is not None else snapshot()
+    lines = []
+    for name, rows in data["counters"].items():
+        metric = PROMETHEUS_PREFIX + name
+        lines.append(f"# TYPE {metric} counter")
+        for row in rows:
+            lines.append(f"{metric}{_format_labels(row['labels'])} {row['value']}")
+    for name, rows in data["histograms"].items():
+        metric = PROMETHEUS_PREFIX + name
+        lines.append(f"# TYPE {metric} histogram")
+        for row in rows:
+            for bound, count in row["buckets"]:
+                labels = _format_labels(row["labels"], {"le": bound})
+                lines.append(f"{metric}_bucket{labels} {count}")
+            lines.append(f"{metric}_sum{_format_labels(row['labels'])} {row['sum']}")
+            lines.append(f"{metric}_count{_format_labels(row['labels'])} {row['count']}")
+    if data["stages"]:
+        seconds = PROMETHEUS_PREFIX + "stage_seconds_total"
+        calls = PROMETHEUS_PREFIX + "stage_calls_total"
+        lines.append(f"# TYPE {seconds} counter")
+        for name, totals in data["stages"].items():
+            lines.append(f'{seconds}{{stage="{name}"}} {totals["seconds"]}')
+        lines.append(f"# TYPE {calls} counter")
+        for name, totals in data["stages"].items():
+            lines.append(f'{calls}{{stage="{name}"}} {totals["calls"]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,211 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+from .synthetic import SyntheticWorld
+
+
+class _RateLimiter:
+    # Non-blocking token bucket: an empty bucket means a 429, like the real API.
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = max(1.0, rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            refill = (now - self._updated) * self.rate
+            self._tokens = min(max(1.0, self.rate), self._tokens + refill)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class MockApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        world: SyntheticWorld,
+        address=("127.0.0.1", 0),
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_429_rate: float = 0.0,
+        error_503_rate: float = 0.0,
+        rate_limit: float = 0.0,
+        max_age: int = 120,
+        seed: int = 0,
+    ):
+        super().__init__(address, _Handler)
+        self.world = world
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_429_rate = error_429_rate
+        self.error_503_rate = error_503_rate
+        self.limiter = _RateLimiter(rate_limit) if rate_limit > 0 else None
+        self.max_age = max_age
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {}
+
+    def roll(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def resolve(self, path: str, query) -> Optional[Dict]:
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+        if len(parts) < 3 or parts[0] != "v1":
+            return None
+        world = self.world
+        if parts[1] == "players" and len(parts) == 3:
+            self.count("players")
+            return world.player(parts[2])
+        if parts[1] != "clans":
+            return None
+        clan_tag = parts[2]
+        if len(parts) == 3:
+            self.count("clans")
+            return world.clan(clan_tag)
+        resource = parts[3]
+        self.count(resource)
+        if resource == "members":
+            return world.members(clan_tag)
+        if resource == "currentwar":
+            return world.current_war(clan_tag)
+        if resource == "warlog":
+            limit = int(query.get("limit", ["25"])[0])
+            return world.warlog(clan_tag, limit, query.get("after", [None])[0])
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: MockApiServer
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status: int, body: Optional[Dict] = None, headers=None) -> None:
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if payload:
+            self.wfile.write(payload)
+
+    def do_GET(self):
+        server = self.server
+        server.count("requests")
+        if server.latency_ms or server.jitter_ms:
+            delay = server.latency_ms + server.jitter_ms * (2 * server.roll() - 1)
+            time.sleep(max(0.0, delay) / 1000)
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            server.count("403")
+            self._send(403, {"reason": "accessDenied", "message": "Missing token"})
+            return
+        if server.limiter is not None and not server.limiter.allow():
+            server.count("429")
+            self._send(429, {"reason": "requestThrottled"}, {"Retry-After": "1"})
+            return
+        roll = server.roll()
+        if roll < server.error_429_rate:
+            server.count("429")
+            self._send(429, {"reason": "requestThrottled"}, {"Retry-After": "1"})
+            return
+        if roll < server.error_429_rate + server.error_503_rate:
+            server.count("503")
+            self._send(503, {"reason": "inMaintenance"})
+            return
+
+        url = urlparse(self.path)
+        body = server.resolve(url.path, parse_qs(url.query))
+        if body is None:
+            server.count("404")
+            self._send(404, {"reason": "notFound"})
+            return
+        etag = '"%s"' % hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest()
+        headers = {"ETag": etag, "Cache-Control": f"public, max-age={server.max_age}"}
+        if self.headers.get("If-None-Match") == etag:
+            server.count("304")
+            self._send(304, None, headers)
+            return
+        self._send(200, body, headers)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_mock_server(world: Optional[SyntheticWorld] = None, **options) -> MockApiServer:
+    server = MockApiServer(world or SyntheticWorld(), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic Clash API data locally")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--clans", type=int, default=1)
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--war-size", type=int, default=50)
+    parser.add_argument("--warlog-wars", type=int, default=60)
+    parser.add_argument("--war-progress", type=float, default=1.0)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-429-rate", type=float, default=0.0)
+    parser.add_argument("--error-503-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Requests per second")
+    parser.add_argument("--max-age", type=int, default=120)
+    args = parser.parse_args()
+
+    world = SyntheticWorld(
+        args.seed, args.clans, args.members, args.war_size, args.warlog_wars, args.war_progress
+    )
+    server = MockApiServer(
+        world,
+        (args.host, args.port),
+        args.latency_ms,
+        args.jitter_ms,
+        args.error_429_rate,
+        args.error_503_rate,
+        args.rate_limit,
+        args.max_age,
+        args.seed,
+    )
+    print(f"API simulada en {server.base_url} (COC_API_BASE={server.base_url})")
+    print("Clanes: " + ", ".join(world.clan_tags[:5]) + (" ..." if world.clans > 5 else ""))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,21 @@
+import hashlib
+import json
 from typing import Dict, List
 
+from . import metrics
+
+PROFILE_SOURCE_KEYS = (
+    "tag",
+    "name",
+    "townHallLevel",
+    "expLevel",
+    "troops",
+    "spells",
+    "pets",
+    "heroes",
+    "heroEquipment",
+)
+
 
 def _dedupe_units(units: List[dict]) -> List[dict]:
     seen = {}
@@ -35,6 +51,7 @@ def _extract_units(player_json: dict, key: str) -> List[dict]:
     return _dedupe_units(units)
 
 
+@metrics.timed("normalize_player")
 def normalize_player(player_json: dict) -> Dict:
     return {
         "tag": player_json.get("tag"),
@@ -51,3 +68,12 @@ def normalize_player(player_json: dict) -> Dict:
         },
         "derived": {},
     }
+
+
+def profile_source_hash(player_json: dict) -> str:
+    # Only the fields normalize_player reads, so trophy or donation churn does
+    # not count as a profile change.
+    source = {key: player_json.get(key) for key in PROFILE_SOURCE_KEYS}
+    source["clanTag"] = (player_json.get("clan") or {}).get("tag")
+    encoded = json.dumps(source, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
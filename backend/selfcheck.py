@@ -0,0 +1,250 @@
+import argparse
+import copy
+import http.client
+import os
+import random
+import sys
+import tempfile
+from collections import defaultdict
+from statistics import mean
+
+from .derive import coverage, pct, top_donors_by_category, top_units_by_category
+from .export.export_active_war import average_units, compute_gaps
+from .export.export_clan_snapshot import (
+    AGGREGATE_CATEGORIES,
+    build_aggregates,
+    build_profile,
+    load_snapshot_state,
+    update_snapshot,
+)
+from .server import start_dashboard_server
+from .synthetic import SyntheticWorld
+
+# Equivalence checks for the optimized aggregate paths, run on synthetic
+# rosters, plus the dashboard server's path scoping:
+# python -m backend.selfcheck. Exits 1 on any mismatch.
+
+
+# Reference helpers: the dict + statistics.mean implementations the NumPy
+# matrix replaced. Published numbers must not drift from them.
+def _reference_values(profiles, category):
+    totals = defaultdict(list)
+    for profile in profiles:
+        for unit in profile.get("categories", {}).get(category, []):
+            value = pct(unit.get("level"), unit.get("maxLevel"))
+            if value is not None:
+                totals[unit.get("name")].append(value)
+    return totals
+
+
+def reference_top_units(profiles, category):
+    total_players = max(len(profiles), 1)
+    results = []
+    for unit_name, values in _reference_values(profiles, category).items():
+        avg_pct = mean(values)
+        availability = len(values) / total_players
+        results.append(
+            {
+                "unit": unit_name,
+                "strength": round(avg_pct * availability, 4),
+                "avgPct": round(avg_pct, 4),
+                "availability": round(availability, 4),
+            }
+        )
+    results.sort(key=lambda item: item["strength"], reverse=True)
+    return results
+
+
+def reference_coverage(profiles, category):
+    total_players = max(len(profiles), 1)
+    results = []
+    for unit_name, values in _reference_values(profiles, category).items():
+        coverage90 = sum(1 for value in values if value >= 0.9)
+        results.append(
+            {
+                "unit": unit_name,
+                "coverage90": coverage90,
+                "coverageRate": round(coverage90 / total_players, 4),
+                "avgPct": round(mean(values), 4),
+            }
+        )
+    results.sort(key=lambda item: (item["coverage90"], item["avgPct"]), reverse=True)
+    return results
+
+
+def reference_top_donors(profiles, category, limit=3):
+    donors = defaultdict(list)
+    for profile in profiles:
+        for unit in profile.get("categories", {}).get(category, []):
+            level = unit.get("level")
+            max_level = unit.get("maxLevel")
+            value = pct(level, max_level)
+            if value is None:
+                continue
+            donors[unit.get("name")].append(
+                {
+                    "name": profile.get("name"),
+                    "tag": profile.get("tag"),
+                    "level": level,
+                    "maxLevel": max_level,
+                    "pct": round(value, 4),
+                }
+            )
+    results = {}
+    for unit_name, entries in donors.items():
+        entries.sort(key=lambda item: (item["pct"], item["level"]), reverse=True)
+        results[unit_name] = entries[:limit]
+    return results
+
+
+def reference_averages(profiles, category):
+    return {name: mean(values) for name, values in _reference_values(profiles, category).items()}
+
+
+def reference_gaps(clan_profiles, opponent_profiles, category):
+    clan_avg = reference_averages(clan_profiles, category)
+    opponent_avg = reference_averages(opponent_profiles, category)
+    return {
+        unit: round(clan_avg.get(unit, 0) - opponent_avg.get(unit, 0), 4)
+        for unit in set(clan_avg) | set(opponent_avg)
+    }
+
+
+def _roster(world, clan_tag):
+    return [build_profile(world.player(tag)) for tag in world.member_tags(clan_tag)]
+
+
+def check_unit_matrix(seeds):
+    failures = []
+    for seed in seeds:
+        world = SyntheticWorld(seed=seed, clans=1)
+        clan_tag = world.clan_tags[0]
+        profiles = _roster(world, clan_tag)
+        opponents = _roster(world, world.opponent_tag(clan_tag))
+        for category in AGGREGATE_CATEGORIES:
+            checks = [
+                ("topUnits", top_units_by_category, reference_top_units),
+                ("coverage", coverage, reference_coverage),
+                ("topDonors", top_donors_by_category, reference_top_donors),
+                ("averages", average_units, reference_averages),
+            ]
+            for name, current, reference in checks:
+                if current(profiles, category) != reference(profiles, category):
+                    failures.append(f"seed {seed} {category} {name}")
+            # Tie order among equal |gap| differs by design; compare the values.
+            gaps = compute_gaps(profiles, opponents, category, limit=10_000)
+            if {row["unit"]: row["gapPct"] for row in gaps} != reference_gaps(
+                profiles, opponents, category
+            ):
+                failures.append(f"seed {seed} {category} gaps")
+    return failures
+
+
+def _mutate(rng, roster, pool):
+    # One round of roster churn: level changes, joins, leaves and reorders.
+    for player_json in rng.sample(roster, min(len(roster), rng.randint(1, 5))):
+        index = roster.index(player_json)
+        player_json = copy.deepcopy(player_json)
+        for key in AGGREGATE_CATEGORIES:
+            for unit in rng.sample(player_json[key], min(len(player_json[key]), 3)):
+                unit["level"] = rng.randint(1, unit["maxLevel"])
+        roster[index] = player_json
+    if pool and rng.random() < 0.4:
+        roster.insert(rng.randrange(len(roster) + 1), pool.pop())
+    if len(roster) > 1 and rng.random() < 0.4:
+        pool.insert(0, roster.pop(rng.randrange(len(roster))))
+    if rng.random() < 0.3:
+        rng.shuffle(roster)
+
+
+def check_incremental_snapshot(seeds, rounds):
+    # update_snapshot (incrementalSnapshot) must publish exactly what
+    # build_aggregates (the full rebuild) does, round after round.
+    failures = []
+    for seed in seeds:
+        world = SyntheticWorld(seed=seed, clans=1)
+        clan_tag = world.clan_tags[0]
+        rng = random.Random(seed)
+        roster = [world.player(tag) for tag in world.member_tags(clan_tag)]
+        pool = [world.player(tag) for tag in world.member_tags(world.opponent_tag(clan_tag))]
+        state = load_snapshot_state("", clan_tag)
+        for round_index in range(rounds):
+            tags = [player_json["tag"] for player_json in roster]
+            _, aggregates, _ = update_snapshot(state, tags, roster)
+            expected = build_aggregates([build_profile(player_json) for player_json in roster])
+            for key in expected:
+                if aggregates[key] != expected[key]:
+                    failures.append(f"seed {seed} round {round_index} {key}")
+            _mutate(rng, roster, pool)
+    return failures
+
+
+def check_server_paths():
+    # Only files under web/ and outputs/ are served; anything else, including
+    # URLs realpath cannot handle, gets a 404 instead of killing the handler.
+    expected = {
+        "/web/index.html": 200,
+        "/web/a%00b": 404,
+        "/backend/outputs/a%00b.json": 404,
+        "/web/../secret.txt": 404,
+        "/web/%2e%2e/secret.txt": 404,
+        "/web/.hidden": 404,
+    }
+    failures = []
+    with tempfile.TemporaryDirectory() as root:
+        web_dir = os.path.join(root, "web")
+        output_dir = os.path.join(root, "outputs")
+        os.makedirs(web_dir)
+        os.makedirs(output_dir)
+        for path in ("web/index.html", "web/.hidden", "secret.txt"):
+            with open(os.path.join(root, path), "w", encoding="utf-8") as handle:
+                handle.write("x")
+        server = start_dashboard_server(
+            "127.0.0.1", 0, web_dir=web_dir, output_dir=output_dir, watch_seconds=60
+        )
+        try:
+            for url, status in expected.items():
+                connection = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+                try:
+                    connection.request("GET", url)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status != status:
+                        failures.append(f"server {url}: {response.status} != {status}")
+                except (OSError, http.client.HTTPException) as error:
+                    failures.append(f"server {url}: {error!r}")
+                finally:
+                    connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+    return failures
+
+
+def _seed_range(text: str):
+    first, _, last = text.partition("-")
+    return range(int(first), int(last or first) + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check optimized aggregates against references")
+    parser.add_argument("--seeds", default="1-14", help="Seed range, e.g. 1-14")
+    parser.add_argument("--rounds", type=int, default=60, help="Incremental snapshot rounds")
+    args = parser.parse_args()
+
+    seeds = _seed_range(args.seeds)
+    failures = (
+        check_unit_matrix(seeds)
+        + check_incremental_snapshot(seeds[:3], args.rounds)
+        + check_server_paths()
+    )
+    for line in failures:
+        print(f"  {line}")
+    if failures:
+        print(f"Diferencias: {len(failures)}")
+        sys.exit(1)
+    print("Sin diferencias frente a las implementaciones de referencia.")
+
+
+if __name__ == "__main__":
+    main()
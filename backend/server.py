@@ -0,0 +1,413 @@
+import argparse
+import email.utils
+import gzip
+import json
+import mimetypes
+import os
+import sys
+import threading
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+WEB_DIR = os.path.join(REPO_ROOT, "web")
+OUTPUT_DIR = os.path.join(REPO_ROOT, "backend", "outputs")
+INDEX_PATH = "/web/pages/clan.html"
+EVENTS_PATH = "/events"
+OUTPUT_PREFIX = "/backend/outputs/"
+# Rewritten on every run without carrying new dashboard data.
+SILENT_OUTPUTS = (".state.json", "metrics.json")
+KEEPALIVE_SECONDS = 15.0
+
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".json": "application/json; charset=utf-8",
+    ".jsonl": "application/x-ndjson; charset=utf-8",
+    ".prom": "text/plain; version=0.0.4; charset=utf-8",
+}
+COMPRESSIBLE = (".html", ".js", ".css", ".json", ".jsonl", ".prom", ".svg", ".txt")
+# Smaller bodies do not shrink enough to pay for the encoding.
+MIN_COMPRESS_BYTES = 1024
+# Files on disk next to the original (write_output's .json.gz) win over
+# compressing in memory.
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _encoders():
+    encoders = {"gzip": lambda data: gzip.compress(data, compresslevel=6, mtime=0)}
+    if brotli is not None:
+        encoders["br"] = lambda data: brotli.compress(data, quality=5)
+    return encoders
+
+
+class HotCache:
+    # Bodies (and their encoded variants) keyed by path; every request stats
+    # the file, so a new mtime or size drops the stale copy.
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_file_bytes: int = 8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entry_size(entry) -> int:
+        return sum(len(body) for body in entry["bodies"].values())
+
+    def _drop(self, path: str) -> None:
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._bytes -= self._entry_size(entry)
+
+    def get(self, path: str, version: Tuple[int, int], encoding: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            if entry["version"] != version:
+                self._drop(path)
+                return None
+            self._entries.move_to_end(path)
+            return entry["bodies"].get(encoding)
+
+    def put(self, path: str, version: Tuple[int, int], encoding: str, body: bytes) -> None:
+        if len(body) > self.max_file_bytes:
+            return
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry["version"] != version:
+                self._drop(path)
+                entry = {"version": version, "bodies": {}}
+                self._entries[path] = entry
+            previous = entry["bodies"].get(encoding)
+            entry["bodies"][encoding] = body
+            self._bytes += len(body) - (len(previous) if previous else 0)
+            self._entries.move_to_end(path)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+
+
+class OutputWatcher:
+    # Polls output mtimes: the exporter may run in this process, in watch mode
+    # or in batch workers, so the file system is the one signal they share.
+    def __init__(self, output_dir: str, interval_seconds: float = 1.0, history: int = 100):
+        self.output_dir = output_dir
+        self.interval_seconds = interval_seconds
+        self.version = 0
+        self._events = deque(maxlen=history)
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def _scan(self) -> Dict[str, int]:
+        found = {}
+        for directory, _, names in os.walk(self.output_dir):
+            for name in names:
+                if not name.endswith(".json") or name.endswith(SILENT_OUTPUTS):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    found[path] = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+        return found
+
+    def _url(self, path: str) -> str:
+        relative = os.path.relpath(path, self.output_dir)
+        return OUTPUT_PREFIX + relative.replace(os.sep, "/")
+
+    def _run(self) -> None:
+        previous = self._scan()
+        while not self._stopped.wait(self.interval_seconds):
+            current = self._scan()
+            changed = sorted(
+                self._url(path) for path, mtime in current.items() if previous.get(path) != mtime
+            )
+            previous = current
+            if changed:
+                self.publish(changed)
+
+    def publish(self, paths: List[str]) -> None:
+        with self._condition:
+            self.version += 1
+            self._events.append((self.version, paths))
+            self._condition.notify_all()
+
+    def wait(self, after: int, timeout: float):
+        # Events newer than `after`; a client too far behind reloads everything.
+        with self._condition:
+            self._condition.wait_for(lambda: self.version > after or self.stopped, timeout)
+            if self.version <= after:
+                return [], self.version
+            if not self._events or self._events[0][0] > after + 1:
+                return [(self.version, ["*"])], self.version
+            return [event for event in self._events if event[0] > after], self.version
+
+
+class DashboardServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("", 8000),
+        web_dir: str = WEB_DIR,
+        output_dir: str = OUTPUT_DIR,
+        cache_max_bytes: int = 64 * 1024 * 1024,
+        watch_seconds: float = 1.0,
+    ):
+        super().__init__(address, _Handler)
+        # URL prefix -> directory; nothing outside these roots is served.
+        self.roots = {
+            "/web/": os.path.realpath(web_dir),
+            OUTPUT_PREFIX: os.path.realpath(output_dir),
+        }
+        self.cache = HotCache(cache_max_bytes)
+        self.encoders = _encoders()
+        self.watcher = OutputWatcher(self.roots[OUTPUT_PREFIX], watch_seconds)
+        self.watcher.start()
+
+    def server_close(self) -> None:
+        self.watcher.stop()
+        super().server_close()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        if host in ("", "0.0.0.0"):
+            host = "localhost"
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # Browsers drop keep-alive connections and abort reloads all the time.
+        error = sys.exc_info()[1]
+        if not isinstance(error, ConnectionError):
+            super().handle_error(request, client_address)
+
+    def resolve(self, url_path: str) -> Optional[str]:
+        for prefix, root in self.roots.items():
+            if not url_path.startswith(prefix):
+                continue
+            relative = url_path[len(prefix) :]
+            parts = [part for part in relative.split("/") if part]
+            # Hidden files and in-progress temp files stay private.
+            if any(part.startswith(".") for part in parts) or relative.endswith(".tmp"):
+                return None
+            # realpath raises on a NUL byte (e.g. /web/a%00b) instead of resolving.
+            if "\x00" in relative:
+                return None
+            path = os.path.realpath(os.path.join(root, *parts))
+            if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+                return None
+            return path
+        return None
+
+
+def _accepted_encodings(header: str):
+    accepted = set()
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: DashboardServer
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def _send_empty(self, status: int, headers=None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _select(self, path: str, stat, accepted):
+        # Returns (encoding, body path or None, version) for the best variant.
+        for encoding, suffix in PRECOMPRESSED:
+            if encoding not in accepted:
+                continue
+            try:
+                variant = os.stat(path + suffix)
+            except FileNotFoundError:
+                continue
+            # A variant older than the file is left over from a previous export.
+            if variant.st_mtime_ns >= stat.st_mtime_ns:
+                return encoding, path + suffix, (variant.st_mtime_ns, variant.st_size)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if path.endswith(COMPRESSIBLE) and stat.st_size >= MIN_COMPRESS_BYTES:
+            for encoding in ("br", "gzip"):
+                if encoding in accepted and encoding in self.server.encoders:
+                    return encoding, None, version
+        return "identity", path, version
+
+    def _body(self, path: str, encoding: str, body_path: Optional[str], version) -> bytes:
+        cache = self.server.cache
+        key = body_path or path
+        body = cache.get(key, version, encoding)
+        if body is not None:
+            return body
+        if body_path is not None:
+            with open(body_path, "rb") as handle:
+                body = handle.read()
+        else:
+            identity = cache.get(path, version, "identity")
+            if identity is None:
+                with open(path, "rb") as handle:
+                    identity = handle.read()
+                cache.put(path, version, "identity", identity)
+            body = self.server.encoders[encoding](identity)
+        cache.put(key, version, encoding, body)
+        return body
+
+    def _serve(self, head: bool) -> None:
+        url_path = unquote(urlparse(self.path).path)
+        if url_path == EVENTS_PATH and not head:
+            self._serve_events()
+            return
+        if url_path in ("/", "/web", "/web/"):
+            self._send_empty(302, {"Location": INDEX_PATH})
+            return
+        path = self.server.resolve(url_path)
+        if path is None:
+            self._send_empty(404)
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._send_empty(404)
+            return
+
+        accepted = _accepted_encodings(self.headers.get("Accept-Encoding", ""))
+        encoding, body_path, version = self._select(path, stat, accepted)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}-{encoding}"'
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        _, extension = os.path.splitext(path)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": last_modified,
+            "Vary": "Accept-Encoding",
+            # Outputs change during a war; validation is a cheap 304 either way.
+            "Cache-Control": "no-cache",
+        }
+        if self._not_modified(etag, stat.st_mtime):
+            self._send_empty(304, headers)
+            return
+
+        try:
+            body = self._body(path, encoding, body_path, version)
+        except FileNotFoundError:
+            self._send_empty(404)
+            return
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        content_type = CONTENT_TYPES.get(extension) or (
+            mimetypes.guess_type(path)[0] or "application/octet-stream"
+        )
+        self.send_header("Content-Type", content_type)
+        if encoding != "identity":
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _serve_events(self) -> None:
+        # Server-Sent Events: one "outputs" event per batch of rewritten files.
+        watcher = self.server.watcher
+        last_id = self.headers.get("Last-Event-ID", "")
+        after = int(last_id) if last_id.isdigit() else watcher.version
+        # An id from before a server restart cannot be replayed.
+        after = min(after, watcher.version)
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("X-Accel-Buffering", "no")
+        self.end_headers()
+        try:
+            self.wfile.write(b"retry: 3000\n\n")
+            self.wfile.flush()
+            while not watcher.stopped:
+                events, after = watcher.wait(after, KEEPALIVE_SECONDS)
+                if not events:
+                    self.wfile.write(b": ping\n\n")
+                for version, paths in events:
+                    data = json.dumps({"paths": paths})
+                    self.wfile.write(f"id: {version}\nevent: outputs\ndata: {data}\n\n".encode())
+                self.wfile.flush()
+        except ConnectionError:
+            pass
+
+    def _not_modified(self, etag: str, mtime: float) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since
+        return False
+
+    def log_message(self, *args):
+        pass
+
+
+def start_dashboard_server(host: str = "", port: int = 8000, **options):
+    server = DashboardServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the dashboard and its exported data")
+    parser.add_argument("--host", default="", help="Default: every interface")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    server = DashboardServer((args.host, args.port), output_dir=args.output_dir)
+    print(f"Dashboard en {server.base_url}{INDEX_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
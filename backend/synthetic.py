@@ -0,0 +1,420 @@
+import base64
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+# Deterministic stand-in data shaped like the Clash of Clans API, sized for
+# benchmarks: every clan, player and war is derived from (seed, tag), so large
+# worlds cost nothing until a tag is actually requested.
+
+TAG_ALPHABET = "0289PYLQGRJCUV"
+MEMBER_SLOTS = 100
+CLAN_BASE = 20_000
+PLAYER_BASE = 2_000_000
+MAX_TH = 17
+
+# (name, maxLevel, town hall that unlocks it)
+TROOPS = (
+    ("Barbarian", 12, 1),
+    ("Archer", 12, 1),
+    ("Giant", 12, 2),
+    ("Goblin", 9, 2),
+    ("Wall Breaker", 13, 3),
+    ("Balloon", 11, 4),
+    ("Wizard", 12, 5),
+    ("Healer", 9, 6),
+    ("Dragon", 12, 7),
+    ("P.E.K.K.A", 11, 8),
+    ("Baby Dragon", 10, 9),
+    ("Miner", 10, 10),
+    ("Electro Dragon", 7, 11),
+    ("Yeti", 6, 12),
+    ("Dragon Rider", 4, 13),
+    ("Electro Titan", 3, 14),
+    ("Root Rider", 3, 15),
+    ("Minion", 12, 7),
+    ("Hog Rider", 13, 7),
+    ("Valkyrie", 11, 8),
+    ("Golem", 13, 8),
+    ("Witch", 7, 9),
+    ("Lava Hound", 6, 9),
+    ("Bowler", 8, 10),
+    ("Ice Golem", 8, 11),
+    ("Headhunter", 3, 12),
+    ("Apprentice Warden", 4, 13),
+    ("Wall Wrecker", 5, 12),
+    ("Battle Blimp", 4, 12),
+    ("Stone Slammer", 5, 12),
+    ("Siege Barracks", 5, 13),
+    ("Log Launcher", 5, 13),
+    ("Flame Flinger", 5, 14),
+    ("Battle Drill", 5, 15),
+)
+SUPER_TROOPS = ("Super Barbarian", "Super Wizard", "Sneaky Goblin", "Super Minion")
+BUILDER_TROOPS = (("Raged Barbarian", 20, 1), ("Sneaky Archer", 20, 1), ("Boxer Giant", 20, 1))
+SPELLS = (
+    ("Lightning Spell", 11, 5),
+    ("Healing Spell", 10, 6),
+    ("Rage Spell", 6, 7),
+    ("Jump Spell", 5, 9),
+    ("Freeze Spell", 7, 9),
+    ("Clone Spell", 8, 10),
+    ("Invisibility Spell", 4, 11),
+    ("Recall Spell", 5, 13),
+    ("Poison Spell", 10, 8),
+    ("Earthquake Spell", 5, 8),
+    ("Haste Spell", 5, 9),
+    ("Skeleton Spell", 8, 10),
+    ("Bat Spell", 6, 10),
+    ("Overgrowth Spell", 2, 16),
+)
+HEROES = (
+    ("Barbarian King", 95, 7),
+    ("Archer Queen", 95, 9),
+    ("Minion Prince", 80, 9),
+    ("Grand Warden", 70, 11),
+    ("Royal Champion", 45, 13),
+)
+HERO_EQUIPMENT = (
+    ("Barbarian Puppet", 18, 8),
+    ("Rage Vial", 18, 8),
+    ("Earthquake Boots", 18, 8),
+    ("Vampstache", 18, 8),
+    ("Giant Gauntlet", 27, 8),
+    ("Archer Puppet", 18, 9),
+    ("Invisibility Vial", 18, 9),
+    ("Giant Arrow", 18, 9),
+    ("Healer Puppet", 18, 9),
+    ("Frozen Arrow", 27, 9),
+    ("Henchmen Puppet", 18, 9),
+    ("Dark Orb", 18, 9),
+    ("Eternal Tome", 18, 11),
+    ("Life Gem", 18, 11),
+    ("Rage Gem", 18, 11),
+    ("Healing Tome", 18, 11),
+    ("Fireball", 27, 11),
+    ("Lavaloon Puppet", 27, 11),
+    ("Royal Gem", 18, 13),
+    ("Seeking Shield", 18, 13),
+    ("Haste Vial", 18, 13),
+    ("Hog Rider Puppet", 18, 13),
+    ("Rocket Spear", 27, 13),
+    ("Spiky Ball", 27, 8),
+    ("Electro Boots", 18, 13),
+)
+PETS = (
+    ("L.A.S.S.I", 15, 14),
+    ("Electro Owl", 10, 14),
+    ("Mighty Yak", 15, 14),
+    ("Unicorn", 10, 14),
+    ("Frosty", 10, 15),
+    ("Diggy", 10, 15),
+    ("Poison Lizard", 10, 15),
+    ("Phoenix", 10, 15),
+    ("Spirit Fox", 10, 16),
+    ("Angry Jelly", 10, 16),
+)
+
+
+def encode_tag(number: int) -> str:
+    digits = []
+    while True:
+        number, remainder = divmod(number, len(TAG_ALPHABET))
+        digits.append(TAG_ALPHABET[remainder])
+        if not number:
+            break
+    return "#" + "".join(reversed(digits))
+
+
+def decode_tag(tag: str) -> Optional[int]:
+    number = 0
+    for char in tag.lstrip("#").upper():
+        index = TAG_ALPHABET.find(char)
+        if index < 0:
+            return None
+        number = number * len(TAG_ALPHABET) + index
+    return number
+
+
+def _api_time(value: datetime) -> str:
+    return value.strftime("%Y%m%dT%H%M%S.000Z")
+
+
+def _encode_cursor(position: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"pos": position}).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(padded))["pos"])
+    except (ValueError, KeyError, TypeError):
+        return 0
+
+
+class SyntheticWorld:
+    # `clans` home clans, each with its own war opponent; opponents are full
+    # clans too, so /players answers for both sides of every war.
+    def __init__(
+        self,
+        seed: int = 1,
+        clans: int = 1,
+        members_per_clan: int = 50,
+        war_size: int = 50,
+        warlog_wars: int = 60,
+        war_progress: float = 1.0,
+        now: Optional[datetime] = None,
+    ):
+        if members_per_clan > MEMBER_SLOTS:
+            raise RuntimeError(f"members_per_clan must be at most {MEMBER_SLOTS}")
+        self.seed = seed
+        self.clans = clans
+        self.members_per_clan = members_per_clan
+        self.war_size = min(war_size, members_per_clan)
+        self.warlog_wars = warlog_wars
+        self.war_progress = war_progress
+        self.now = (now or datetime(2026, 1, 1, tzinfo=timezone.utc)).replace(microsecond=0)
+        self._players: Dict[str, Dict[str, Any]] = {}
+
+    def _rng(self, *parts) -> random.Random:
+        return random.Random(":".join(str(part) for part in (self.seed, *parts)))
+
+    def _clan_index(self, clan_tag: str) -> Optional[int]:
+        number = decode_tag(clan_tag)
+        if number is None:
+            return None
+        index = number - CLAN_BASE
+        return index if 0 <= index < 2 * self.clans else None
+
+    @property
+    def clan_tags(self) -> List[str]:
+        return [encode_tag(CLAN_BASE + index) for index in range(self.clans)]
+
+    def opponent_tag(self, clan_tag: str) -> Optional[str]:
+        index = self._clan_index(clan_tag)
+        if index is None:
+            return None
+        if index < self.clans:
+            return encode_tag(CLAN_BASE + self.clans + index)
+        return encode_tag(CLAN_BASE + index - self.clans)
+
+    def member_tags(self, clan_tag: str) -> List[str]:
+        index = self._clan_index(clan_tag)
+        if index is None:
+            return []
+        first = PLAYER_BASE + index * MEMBER_SLOTS
+        return [encode_tag(first + slot) for slot in range(self.members_per_clan)]
+
+    def player_count(self) -> int:
+        return 2 * self.clans * self.members_per_clan
+
+    def _units(self, rng, catalog, th, progress, village="home"):
+        units = []
+        for name, max_level, unlock_th in catalog:
+            if th < unlock_th:
+                continue
+            # Higher town halls allow a larger share of the global max level.
+            share = min(1.0, (th - unlock_th + 1) / (MAX_TH - unlock_th + 1))
+            cap = max(1, round(max_level * share))
+            jittered = min(1.0, progress + rng.uniform(-0.2, 0.2))
+            level = max(1, min(cap, round(cap * jittered)))
+            units.append({"name": name, "level": level, "maxLevel": max_level, "village": village})
+        return units
+
+    def player(self, player_tag: str) -> Optional[Dict[str, Any]]:
+        if player_tag in self._players:
+            return self._players[player_tag]
+        number = decode_tag(player_tag)
+        if number is None or number < PLAYER_BASE:
+            return None
+        clan_index, slot = divmod(number - PLAYER_BASE, MEMBER_SLOTS)
+        if clan_index >= 2 * self.clans or slot >= self.members_per_clan:
+            return None
+        rng = self._rng("player", player_tag)
+        th = max(6, min(MAX_TH, round(rng.gauss(13, 2.5))))
+        progress = min(1.0, max(0.2, rng.betavariate(5, 2)))
+        troops = self._units(rng, TROOPS, th, progress)
+        for name in SUPER_TROOPS:
+            if th >= 11 and rng.random() < 0.5:
+                level = rng.randint(1, 10)
+                troop = {"name": name, "level": level, "maxLevel": 10, "village": "home"}
+                if rng.random() < 0.2:
+                    troop["superTroopIsActive"] = True
+                troops.append(troop)
+        troops.extend(self._units(rng, BUILDER_TROOPS, 10, progress, "builderBase"))
+        clan_tag = encode_tag(CLAN_BASE + clan_index)
+        player = {
+            "tag": player_tag,
+            "name": f"Jugador {player_tag[1:]}",
+            "townHallLevel": th,
+            "expLevel": 50 + th * 12 + rng.randint(0, 40),
+            "trophies": rng.randint(1500, 5500),
+            "warStars": rng.randint(50, 2500),
+            "clan": {"tag": clan_tag, "name": self.clan(clan_tag)["name"]},
+            "troops": troops,
+            "spells": self._units(rng, SPELLS, th, progress),
+            "heroes": self._units(rng, HEROES, th, progress),
+            "heroEquipment": self._units(rng, HERO_EQUIPMENT, th, progress),
+            "pets": self._units(rng, PETS, th, progress),
+        }
+        self._players[player_tag] = player
+        return player
+
+    def clan(self, clan_tag: str) -> Optional[Dict[str, Any]]:
+        if self._clan_index(clan_tag) is None:
+            return None
+        rng = self._rng("clan", clan_tag)
+        wins = rng.randint(50, 500)
+        return {
+            "tag": clan_tag,
+            "name": f"Clan {clan_tag[1:]}",
+            "clanLevel": rng.randint(5, 30),
+            "members": self.members_per_clan,
+            "warWins": wins,
+            "warTies": rng.randint(0, wins // 10),
+            "warLosses": rng.randint(10, wins),
+            "warWinStreak": rng.randint(0, 12),
+            "isWarLogPublic": True,
+        }
+
+    def members(self, clan_tag: str) -> Optional[Dict[str, Any]]:
+        if self._clan_index(clan_tag) is None:
+            return None
+        items = []
+        for tag in self.member_tags(clan_tag):
+            player = self.player(tag)
+            items.append(
+                {
+                    "tag": tag,
+                    "name": player["name"],
+                    "role": "member",
+                    "expLevel": player["expLevel"],
+                    "townHallLevel": player["townHallLevel"],
+                    "trophies": player["trophies"],
+                }
+            )
+        return {"items": items, "paging": {"cursors": {}}}
+
+    def _war_side(self, clan_tag: str):
+        roster = sorted(
+            self.member_tags(clan_tag)[: self.war_size],
+            key=lambda tag: -self.player(tag)["townHallLevel"],
+        )
+        return [
+            {
+                "tag": tag,
+                "name": self.player(tag)["name"],
+                "townhallLevel": self.player(tag)["townHallLevel"],
+                "mapPosition": position + 1,
+            }
+            for position, tag in enumerate(roster)
+        ]
+
+    def current_war(self, clan_tag: str) -> Optional[Dict[str, Any]]:
+        opponent_tag = self.opponent_tag(clan_tag)
+        if opponent_tag is None:
+            return None
+        home, away = sorted((clan_tag, opponent_tag))
+        rng = self._rng("war", home)
+        sides = {home: self._war_side(home), away: self._war_side(away)}
+        # Both sides share one global attack order, as in the real endpoint.
+        planned = []
+        for tag, members in sides.items():
+            defenders = sides[away if tag == home else home]
+            for member in members:
+                for _ in range(2):
+                    if rng.random() < 0.9:
+                        target = min(
+                            len(defenders) - 1,
+                            max(0, member["mapPosition"] - 1 + rng.randint(-3, 3)),
+                        )
+                        stars = rng.choices((0, 1, 2, 3), weights=(5, 15, 40, 40))[0]
+                        destruction = (
+                            100 if stars == 3 else rng.randint(max(0, stars * 35), 99)
+                        )
+                        planned.append(
+                            (
+                                member,
+                                {
+                                    "attackerTag": member["tag"],
+                                    "defenderTag": defenders[target]["tag"],
+                                    "stars": stars,
+                                    "destructionPercentage": destruction,
+                                    "duration": rng.randint(60, 180),
+                                },
+                            )
+                        )
+        rng.shuffle(planned)
+        done = int(len(planned) * max(0.0, min(1.0, self.war_progress)))
+        attacks = {tag: [] for members in sides.values() for tag in (m["tag"] for m in members)}
+        for order, (member, attack) in enumerate(planned[:done], start=1):
+            attacks[member["tag"]].append({**attack, "order": order})
+        prep_start = self.now - timedelta(hours=30)
+
+        def team(tag):
+            members = [{**member, "attacks": attacks[member["tag"]]} for member in sides[tag]]
+            return {
+                "tag": tag,
+                "name": self.clan(tag)["name"],
+                "attacks": sum(len(member["attacks"]) for member in members),
+                "stars": sum(attack["stars"] for m in members for attack in m["attacks"]),
+                "members": members,
+            }
+
+        return {
+            "state": "inWar" if done < len(planned) else "warEnded",
+            "teamSize": self.war_size,
+            "attacksPerMember": 2,
+            "preparationStartTime": _api_time(prep_start),
+            "startTime": _api_time(prep_start + timedelta(hours=23)),
+            "endTime": _api_time(prep_start + timedelta(hours=47)),
+            "clan": team(clan_tag),
+            "opponent": team(opponent_tag),
+        }
+
+    def _warlog_entry(self, clan_tag: str, index: int) -> Dict[str, Any]:
+        rng = self._rng("warlog", clan_tag, index)
+        team_size = rng.choice((15, 20, 25, 30, 40, 50))
+        stars = rng.randint(team_size, team_size * 3)
+        opponent_stars = rng.randint(team_size, team_size * 3)
+        result = "win" if stars > opponent_stars else "lose" if stars < opponent_stars else "tie"
+        return {
+            "result": result,
+            "endTime": _api_time(self.now - timedelta(days=2 * (index + 1))),
+            "teamSize": team_size,
+            "attacksPerMember": 2,
+            "clan": {
+                "tag": clan_tag,
+                "name": self.clan(clan_tag)["name"],
+                "clanLevel": 20,
+                "attacks": rng.randint(team_size, team_size * 2),
+                "stars": stars,
+                "destructionPercentage": round(rng.uniform(40, 100), 2),
+                "expEarned": rng.randint(100, 600),
+            },
+            "opponent": {
+                "tag": encode_tag(10_000 + rng.randint(0, 10**6)),
+                "name": f"Rival {index}",
+                "clanLevel": rng.randint(5, 30),
+                "stars": opponent_stars,
+                "destructionPercentage": round(rng.uniform(40, 100), 2),
+            },
+        }
+
+    def warlog(
+        self, clan_tag: str, limit: int = 25, after: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        if self._clan_index(clan_tag) is None:
+            return None
+        start = _decode_cursor(after)
+        end = min(self.warlog_wars, start + max(1, limit))
+        cursors = {"after": _encode_cursor(end)} if end < self.warlog_wars else {}
+        if start:
+            cursors["before"] = _encode_cursor(start)
+        return {
+            "items": [self._warlog_entry(clan_tag, index) for index in range(start, end)],
+            "paging": {"cursors": cursors},
+        }
@@ -1,8 +1,9 @@
-import json
+import argparse
 import os
-import subprocess
-import sys
-from pathlib import Path
+
+from backend.export.pipeline import run_pipeline
+from backend.export.watch import run_watch
+from backend.server import DashboardServer, start_dashboard_server
 
 
 def prompt_value(label: str) -> str:
@@ -12,7 +13,23 @@ def prompt_value(label: str) -> str:
     return value
 
 
+def print_urls(base_url: str) -> None:
+    print(f"\nServidor listo en {base_url}/web/pages/clan.html")
+    print(f"War Active: {base_url}/web/pages/war.html")
+    print(f"War Execution: {base_url}/web/pages/war_execution.html")
+    print("Presiona CTRL+C para detener el servidor.")
+
+
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Export data and serve the dashboard")
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Mantiene los JSON actualizados mientras el servidor está activo",
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
     clan_tag = prompt_value("Clan tag (ej. #CLANTAG): ")
     token = prompt_value("Token API: ")
 
@@ -21,48 +38,61 @@ def main() -> None:
     config = {
         "clanTag": clan_tag,
         "tokenEnvVar": "COC_API_TOKEN",
+        "apiBaseUrl": "",
         "sleepSeconds": 0.25,
+        "requestsPerSecond": 8,
+        "maxWorkers": 8,
+        "httpPoolSize": 8,
+        "maxRetries": 3,
+        "retryBaseSeconds": 0.5,
+        "retryMaxSeconds": 30,
+        "circuitBreakerThreshold": 5,
+        "circuitBreakerCooldownSeconds": 30,
+        "cacheBackend": "file",
+        "cacheCompression": "gzip",
         "cacheTtlSeconds": 3600,
+        "staleWhileRevalidateSeconds": 0,
+        "cacheMaxAgeSeconds": 604800,
+        "cacheMaxEntries": 5000,
+        "cacheMaxBytes": 268435456,
+        "watchWarSeconds": 60,
+        "watchIdleSeconds": 600,
+        "watchRosterSeconds": 3600,
+        "minifyOutputs": True,
+        "gzipOutputs": False,
+        "shardedOutputs": True,
+        "recordHistory": False,
+        "historyPath": "",
         "includeWarlog": False,
+        "warlogBackfill": False,
+        "warlogPageSize": 25,
+        "warlogWindow": 10,
+        "writeMetrics": True,
+        "metricsPrometheus": False,
     }
 
-    config_path = Path("backend") / "config.runtime.json"
-    config_path.write_text(json.dumps(config, indent=2), encoding="utf-8")
-
-    subprocess.check_call(
-        [
-            sys.executable,
-            "-m",
-            "backend.export.export_clan_snapshot",
-            "--config",
-            str(config_path),
-        ]
-    )
-    subprocess.check_call(
-        [
-            sys.executable,
-            "-m",
-            "backend.export.export_active_war",
-            "--config",
-            str(config_path),
-        ]
-    )
-    subprocess.check_call(
-        [
-            sys.executable,
-            "-m",
-            "backend.export.export_war_execution",
-            "--config",
-            str(config_path),
-        ]
-    )
-
-    print("\nServidor listo en http://localhost:8000/web/pages/clan.html")
-    print("War Active: http://localhost:8000/web/pages/war.html")
-    print("War Execution: http://localhost:8000/web/pages/war_execution.html")
-    print("Presiona CTRL+C para detener el servidor.")
+    if not args.watch:
+        run_pipeline(config)
+        server = DashboardServer(("", args.port))
+        print_urls(server.base_url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
 
-    subprocess.check_call([sys.executable, "-m", "http.server", "8000"])
+    # Watch mode: the first refresh cycle performs the initial export.
+    server = start_dashboard_server(port=args.port)
+    print_urls(server.base_url)
+    try:
+        run_watch(config)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
 
 
 if __name__ == "__main__":
@@ -1,4 +1,14 @@
+const SUMMARY_PATH = "/backend/outputs/clan/summary.json";
+const MEMBER_PATH = (tag) => `/backend/outputs/clan/members/${tag.replace("#", "")}.json`;
 const DATA_PATH = "/backend/outputs/clan_snapshot.json";
+const CATEGORY_LABELS = {
+  troops: "Tropas",
+  spells: "Hechizos",
+  heroes: "Héroes",
+  heroEquipment: "Equipamiento",
+  pets: "Mascotas",
+};
+const memberCache = new Map();
 
 const formatPct = (value) => `${Math.round(value * 100)}%`;
 
@@ -126,6 +136,63 @@ const renderThChart = (data) => {
   }
 };
 
+const loadMember = async (player) => {
+  // Legacy monolithic snapshots already carry every category inline.
+  if (player.categories) return player;
+  if (!memberCache.has(player.tag)) {
+    memberCache.set(
+      player.tag,
+      fetch(MEMBER_PATH(player.tag)).then((response) => {
+        if (!response.ok) {
+          memberCache.delete(player.tag);
+          throw new Error(`No se pudo cargar el perfil de ${player.name ?? player.tag}`);
+        }
+        return response.json();
+      })
+    );
+  }
+  return memberCache.get(player.tag);
+};
+
+const renderMemberDetail = (member) => {
+  const categories = Object.entries(member.categories || {}).filter(
+    ([, units]) => Array.isArray(units) && units.length
+  );
+  if (!categories.length) return '<p class="empty-state">Sin datos.</p>';
+  return categories
+    .map(([category, units]) => {
+      const items = units
+        .map((unit) => {
+          const pct = unit.maxLevel ? unit.level / unit.maxLevel : 0;
+          return `<span class="badge ${getHeatClass(pct)}">${unit.name} ${unit.level ?? "--"}/${unit.maxLevel ?? "--"}</span>`;
+        })
+        .join(" ");
+      return `<p><strong>${CATEGORY_LABELS[category] ?? category}:</strong> ${items}</p>`;
+    })
+    .join("");
+};
+
+const toggleMemberDetail = async (row, player, button) => {
+  const next = row.nextElementSibling;
+  if (next?.classList.contains("player-detail")) {
+    next.remove();
+    button.setAttribute("aria-expanded", "false");
+    return;
+  }
+  const detail = document.createElement("tr");
+  detail.className = "player-detail";
+  detail.innerHTML = '<td colspan="5" class="muted">Cargando…</td>';
+  row.after(detail);
+  button.setAttribute("aria-expanded", "true");
+  try {
+    const member = await loadMember(player);
+    detail.firstElementChild.className = "";
+    detail.firstElementChild.innerHTML = renderMemberDetail(member);
+  } catch (error) {
+    detail.firstElementChild.textContent = error.message;
+  }
+};
+
 const renderPlayers = (players) => {
   const body = document.getElementById("players-body");
   body.innerHTML = "";
@@ -158,15 +225,18 @@ const renderPlayers = (players) => {
     row.innerHTML = `
       <td>
         <strong>${player.name ?? "--"}</strong><br />
-        <small>${player.tag ?? ""}</small>
+        <small>${player.tag ?? ""}</small><br />
+        <button type="button" class="link-button" aria-expanded="false">Ver unidades</button>
       </td>
       <td>${player.th ?? "--"}</td>
       <td>
         <span class="badge ${getHeatClass(avgValue)}">${formatPct(avgValue)}</span>
       </td>
       <td>${topListHtml}</td>
-      <td>${player.derived?.superActiveCount ?? 0}</td>
+      <td>${player.derived?.superActiveTroopsCount ?? player.derived?.superActiveCount ?? 0}</td>
     `;
+    const button = row.querySelector(".link-button");
+    button.addEventListener("click", () => toggleMemberDetail(row, player, button));
     body.appendChild(row);
   });
 };
@@ -184,13 +254,18 @@ const filterPlayers = (players, query) => {
 const updateDataNote = (data) => {
   const note = document.getElementById("data-note");
   const generatedAt = data.meta?.generatedAt;
-  const warlog = data.clan?.warlog ? "Warlog incluido." : "Warlog no disponible.";
+  const hasWarlog = data.clan?.hasWarlog ?? Boolean(data.clan?.warlog);
+  const warlog = hasWarlog ? "Warlog incluido." : "Warlog no disponible.";
   note.textContent = generatedAt
     ? `Última actualización: ${new Date(generatedAt).toLocaleString()}. ${warlog}`
     : "Datos cargados.";
 };
 
 const loadData = async () => {
+  // The small summary is enough for the first paint; older exports without
+  // shards still work through the full snapshot.
+  const summary = await fetch(SUMMARY_PATH);
+  if (summary.ok) return summary.json();
   const response = await fetch(DATA_PATH);
   if (!response.ok) {
     throw new Error("No se pudo cargar clan_snapshot.json");
@@ -198,24 +273,33 @@ const loadData = async () => {
   return response.json();
 };
 
-const init = async () => {
+let players = [];
+
+const render = async () => {
   try {
     const data = await loadData();
-    const players = data.members || [];
+    players = data.members || [];
     renderKpis(data);
     renderThChart(data);
-    renderPlayers(players);
+    renderPlayers(filterPlayers(players, document.getElementById("player-search").value));
     updateDataNote(data);
-
-    const search = document.getElementById("player-search");
-    search.addEventListener("input", (event) => {
-      const filtered = filterPlayers(players, event.target.value);
-      renderPlayers(filtered);
-    });
   } catch (error) {
     const note = document.getElementById("data-note");
     note.textContent = error.message;
   }
 };
 
+const init = async () => {
+  const search = document.getElementById("player-search");
+  search.addEventListener("input", (event) => {
+    renderPlayers(filterPlayers(players, event.target.value));
+  });
+  // Member shards are rewritten together with the summary.
+  subscribeToOutputs([SUMMARY_PATH, DATA_PATH], () => {
+    memberCache.clear();
+    return render();
+  });
+  await render();
+};
+
 document.addEventListener("DOMContentLoaded", init);
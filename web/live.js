@@ -0,0 +1,34 @@
+const EVENTS_PATH = "/events";
+
+// backend/server.py announces rewritten outputs over Server-Sent Events; the
+// page refetches only the datasets it shows. onChange calls never overlap.
+const subscribeToOutputs = (paths, onChange) => {
+  if (!window.EventSource) return null;
+  let queued = null;
+  let running = false;
+
+  const flush = async () => {
+    if (running || !queued) return;
+    const changed = [...queued];
+    queued = null;
+    running = true;
+    try {
+      await onChange(changed);
+    } finally {
+      running = false;
+      flush();
+    }
+  };
+
+  const source = new EventSource(EVENTS_PATH);
+  source.addEventListener("outputs", (event) => {
+    const updated = JSON.parse(event.data).paths || [];
+    const changed = updated.includes("*")
+      ? paths
+      : paths.filter((path) => updated.includes(path));
+    if (!changed.length) return;
+    queued = new Set([...(queued || []), ...changed]);
+    flush();
+  });
+  return source;
+};
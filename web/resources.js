@@ -1,3 +1,4 @@
+const AGGREGATES_PATH = "/backend/outputs/clan/aggregates.json";
 const DATA_PATH = "/backend/outputs/clan_snapshot.json";
 
 const formatPct = (value) => `${Math.round(value * 100)}%`;
@@ -150,6 +151,8 @@ const updateNotes = (data) => {
 };
 
 const loadData = async () => {
+  const aggregates = await fetch(AGGREGATES_PATH);
+  if (aggregates.ok) return aggregates.json();
   const response = await fetch(DATA_PATH);
   if (!response.ok) {
     throw new Error("No se pudo cargar clan_snapshot.json");
@@ -157,27 +160,30 @@ const loadData = async () => {
   return response.json();
 };
 
-const init = async () => {
+let donorRows = [];
+
+const render = async () => {
   try {
     const data = await loadData();
     const resources = data.aggregates?.resources || {};
-    const donorRows = flattenDonors(resources).sort((a, b) =>
-      a.unit.localeCompare(b.unit)
-    );
-    renderDonors(donorRows);
+    donorRows = flattenDonors(resources).sort((a, b) => a.unit.localeCompare(b.unit));
+    renderDonors(filterDonors(donorRows, document.getElementById("donor-search").value));
     renderCoverage(resources);
     renderRecommendations(resources);
     updateNotes(data);
-
-    const search = document.getElementById("donor-search");
-    search.addEventListener("input", (event) => {
-      const filtered = filterDonors(donorRows, event.target.value);
-      renderDonors(filtered);
-    });
   } catch (error) {
     const note = document.getElementById("resources-note");
     note.textContent = error.message;
   }
 };
 
+const init = async () => {
+  const search = document.getElementById("donor-search");
+  search.addEventListener("input", (event) => {
+    renderDonors(filterDonors(donorRows, event.target.value));
+  });
+  subscribeToOutputs([AGGREGATES_PATH, DATA_PATH], render);
+  await render();
+};
+
 document.addEventListener("DOMContentLoaded", init);
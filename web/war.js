@@ -1,4 +1,14 @@
 const DATA_PATH = "/backend/outputs/war_active.json";
+const SUMMARY_PATH = "/backend/outputs/war/summary.json";
+const MEMBER_PATH = (tag) => `/backend/outputs/war/members/${tag.replace("#", "")}.json`;
+const CATEGORY_LABELS = {
+  troops: "Tropas",
+  spells: "Hechizos",
+  heroes: "Héroes",
+  heroEquipment: "Equipamiento",
+  pets: "Mascotas",
+};
+const memberCache = new Map();
 
 const formatPct = (value) => `${Math.round(value * 100)}%`;
 
@@ -153,6 +163,60 @@ const renderProfileCard = (member) => {
   return card;
 };
 
+const loadProfile = async (member) => {
+  // Legacy monolithic exports already carry every category inline.
+  if (member.profile?.categories) return member.profile;
+  if (!memberCache.has(member.tag)) {
+    memberCache.set(
+      member.tag,
+      fetch(MEMBER_PATH(member.tag)).then((response) => {
+        if (!response.ok) {
+          memberCache.delete(member.tag);
+          throw new Error(`No se pudo cargar el perfil de ${member.name ?? member.tag}`);
+        }
+        return response.json();
+      })
+    );
+  }
+  return memberCache.get(member.tag);
+};
+
+const renderUnits = (profile) => {
+  const detail = document.createElement("div");
+  const categories = Object.entries(profile.categories || {}).filter(
+    ([, units]) => Array.isArray(units) && units.length
+  );
+  if (!categories.length) {
+    detail.innerHTML = '<p class="empty-state">Sin datos.</p>';
+    return detail;
+  }
+  detail.innerHTML = categories
+    .map(([category, units]) => {
+      const items = units
+        .map((unit) => {
+          const pct = unit.maxLevel ? unit.level / unit.maxLevel : 0;
+          return `<span class="badge ${getHeatClass(pct)}">${unit.name} ${unit.level ?? "--"}/${unit.maxLevel ?? "--"}</span>`;
+        })
+        .join(" ");
+      return `<p><strong>${CATEGORY_LABELS[category] ?? category}:</strong> ${items}</p>`;
+    })
+    .join("");
+  return detail;
+};
+
+const appendUnits = async (panel, member) => {
+  // Power bars come from the summary; unit levels load from the member shard.
+  const status = document.createElement("p");
+  status.className = "empty-state";
+  status.textContent = "Cargando unidades...";
+  panel.appendChild(status);
+  try {
+    status.replaceWith(renderUnits(await loadProfile(member)));
+  } catch (error) {
+    status.textContent = error.message;
+  }
+};
+
 const openCompare = (data, clanTag, opponentTag) => {
   const dialog = document.getElementById("compare-dialog");
   const grid = document.getElementById("compare-grid");
@@ -177,6 +241,7 @@ const openCompare = (data, clanTag, opponentTag) => {
         <small>${member.tag ?? ""}</small>
       `;
       panel.appendChild(renderPowerBars(member.profile));
+      appendUnits(panel, member);
     }
     grid.appendChild(panel);
   });
@@ -184,12 +249,14 @@ const openCompare = (data, clanTag, opponentTag) => {
   dialog.showModal();
 };
 
-const attachCompareHandlers = (data) => {
+let warData = null;
+
+const attachCompareHandlers = () => {
   const body = document.getElementById("matchups-body");
   body.addEventListener("click", (event) => {
     const button = event.target.closest("button[data-clan]");
-    if (!button) return;
-    openCompare(data, button.dataset.clan, button.dataset.opponent);
+    if (!button || !warData) return;
+    openCompare(warData, button.dataset.clan, button.dataset.opponent);
   });
 
   const close = document.getElementById("close-compare");
@@ -199,6 +266,10 @@ const attachCompareHandlers = (data) => {
 };
 
 const loadData = async () => {
+  // The summary (matchups without full profiles) is enough for the first
+  // paint; older exports without shards still work through war_active.json.
+  const summary = await fetch(SUMMARY_PATH);
+  if (summary.ok) return summary.json();
   const response = await fetch(DATA_PATH);
   if (!response.ok) {
     throw new Error("No se pudo cargar war_active.json");
@@ -221,18 +292,28 @@ const renderEmptyState = (state) => {
   }
 };
 
-const init = async () => {
+const render = async () => {
   try {
     const data = await loadData();
+    warData = data;
     renderThreats(data);
     renderGaps(data);
     renderMatchups(data);
     renderEmptyState(data.meta?.state);
-    attachCompareHandlers(data);
   } catch (error) {
     const note = document.getElementById("war-state");
     note.textContent = error.message;
   }
 };
 
+const init = async () => {
+  attachCompareHandlers();
+  // Member shards are rewritten together with the summary.
+  subscribeToOutputs([SUMMARY_PATH, DATA_PATH], () => {
+    memberCache.clear();
+    return render();
+  });
+  await render();
+};
+
 document.addEventListener("DOMContentLoaded", init);
@@ -166,7 +166,7 @@ const loadData = async () => {
   return response.json();
 };
 
-const init = async () => {
+const render = async () => {
   try {
     const data = await loadData();
     renderLeaderboards(data);
@@ -180,4 +180,9 @@ const init = async () => {
   }
 };
 
+const init = async () => {
+  subscribeToOutputs([DATA_PATH], render);
+  await render();
+};
+
 document.addEventListener("DOMContentLoaded", init);